@@ -0,0 +1,263 @@
+import collections
+import inspect
+import math
+import threading
+import wave
+from contextlib import contextmanager
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+INT16_SCALE = np.float32(1.0 / 32768.0)
+
+
+def is_speech(block, threshold):
+    """Energy VAD on int16 samples.
+
+    Compares the mean square with threshold**2 in integer arithmetic, so no
+    float copy of the block (and no sqrt) is needed.
+    """
+    if len(block) == 0:
+        return False
+    energy = np.einsum("i,i->", block, block, dtype=np.int64)
+    return energy > threshold * threshold * len(block)
+
+
+def rms(block):
+    """Root mean square of int16 samples: the level is_speech compares."""
+    if len(block) == 0:
+        return 0.0
+    return math.sqrt(np.einsum("i,i->", block, block, dtype=np.int64) / len(block))
+
+
+def to_dbfs(level):
+    """int16 RMS level in dB relative to full scale."""
+    return 20 * math.log10(max(level, 1.0) / 32768)
+
+
+def read_wav(path, sample_rate):
+    """Reads a 16-bit PCM WAV file as mono int16 at sample_rate."""
+    with wave.open(str(path), "rb") as wav_file:
+        if wav_file.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16-bit PCM WAV files are supported")
+        channels = wav_file.getnchannels()
+        rate = wav_file.getframerate()
+        frames = wav_file.readframes(wav_file.getnframes())
+    audio = np.frombuffer(frames, dtype=np.int16)
+    if channels > 1:
+        audio = audio.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    if rate != sample_rate:
+        positions = np.arange(0, len(audio), rate / sample_rate)
+        audio = np.interp(positions, np.arange(len(audio)), audio).astype(np.int16)
+    return audio
+
+
+class LevelMeter:
+    """Level of the latest int16 block and the noise floor of recent ones.
+
+    The noise floor is a low percentile of the last `history` block levels,
+    so it follows the room between words rather than the speech itself.
+    """
+
+    def __init__(self, history=100, floor_percentile=10):
+        self.levels = collections.deque(maxlen=history)
+        self.floor_percentile = floor_percentile
+
+    def update(self, block):
+        self.levels.append(rms(block))
+
+    @property
+    def level(self):
+        return self.levels[-1] if self.levels else 0.0
+
+    @property
+    def noise_floor(self):
+        levels = list(self.levels)  # update() may run in the audio thread
+        return float(np.percentile(levels, self.floor_percentile)) if levels else 0.0
+
+
+class AudioBuffer:
+    """Collects int16 audio blocks and converts them to float32 once.
+
+    Blocks are kept as a list instead of being concatenated on every append,
+    so each sample is copied once: straight into the float32 array that is
+    passed to the model.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.samples = 0
+
+    def __len__(self):
+        return self.samples
+
+    @property
+    def nbytes(self):
+        return self.samples * np.dtype(np.int16).itemsize
+
+    def append(self, chunk):
+        self.chunks.append(chunk)
+        self.samples += len(chunk)
+
+    def extend(self, other):
+        for chunk in other.chunks:
+            self.append(chunk)
+
+    def to_float32(self):
+        """Returns the audio as float32 in [-1, 1), as Whisper expects."""
+        audio = np.empty(self.samples, dtype=np.float32)
+        offset = 0
+        for chunk in self.chunks:
+            np.multiply(chunk, INT16_SCALE, out=audio[offset : offset + len(chunk)])
+            offset += len(chunk)
+        return audio
+
+
+class LogMelCache:
+    """Log-mel frames of one growing utterance, each computed only once.
+
+    faster-whisper computes the spectrogram of the whole buffer on every
+    decode. A frame only depends on the n_fft samples around it, so frames
+    that lie within audio already seen are kept, and a call only computes
+    the frames after the first changed sample plus the few at the (padded)
+    end. The result is the same as the wrapped extractor's.
+    """
+
+    def __init__(self, extractor):
+        self.n_fft = extractor.n_fft
+        self.hop_length = extractor.hop_length
+        self.mel_filters = extractor.mel_filters
+        self.window = np.hanning(self.n_fft + 1)[:-1].astype(np.float32)
+        self.frames = np.empty((len(self.mel_filters), 256), dtype=np.float32)
+        self.stable = 0  # Leading frames of self.frames that are up to date
+        self.audio = None  # Audio of the last call
+        # Stats: frames computed vs. frames handed to the model
+        self.computed = 0
+        self.served = 0
+
+    def compatible(self, extractor):
+        return (
+            extractor.n_fft == self.n_fft
+            and extractor.hop_length == self.hop_length
+            and extractor.mel_filters.shape == self.mel_filters.shape
+        )
+
+    def features(self, audio, padding):
+        """Returns the normalized log-mel spectrogram of audio."""
+        half, hop = self.n_fft // 2, self.hop_length
+        total = (len(audio) + padding) // hop  # The extractor drops the last frame
+        self.stable = min(self.stable, self._frames_within(self._unchanged(audio)))
+        self.audio = audio
+        if len(audio) <= self.n_fft:
+            padded = np.pad(np.pad(audio, (0, padding)), half, mode="reflect")
+            log_spec = self._log_mel(padded, total)
+        else:
+            stable = min(self._frames_within(len(audio)), total)
+            if stable > self.stable:
+                start = self.stable * hop - half
+                end = (stable - 1) * hop + half
+                if start < 0:  # Window reaches into the reflected start
+                    segment = np.pad(audio[:end], (half, 0), mode="reflect")
+                    segment = segment[start + half :]
+                else:
+                    segment = audio[start:end]
+                self._store(self._log_mel(segment, stable - self.stable))
+            tail = np.pad(audio[self.stable * hop - half :], (0, padding))
+            tail = np.pad(tail, (0, half), mode="reflect")
+            log_spec = np.concatenate(
+                (
+                    self.frames[:, : self.stable],
+                    self._log_mel(tail, total - self.stable),
+                ),
+                axis=1,
+            )
+        np.maximum(log_spec, log_spec.max() - 8.0, out=log_spec)
+        log_spec += 4.0
+        log_spec /= 4.0
+        self.served += total
+        return log_spec
+
+    def _frames_within(self, samples):
+        """Number of leading frames that only depend on audio[:samples]."""
+        if samples <= self.n_fft:
+            return 0
+        return (samples - self.n_fft // 2) // self.hop_length + 1
+
+    def _unchanged(self, audio):
+        """Length of the prefix that the cached frames were computed from."""
+        if self.audio is None or self.stable == 0:
+            return 0
+        length = min(
+            len(audio),
+            len(self.audio),
+            (self.stable - 1) * self.hop_length + self.n_fft // 2,
+        )
+        if audio is self.audio:
+            return length
+        changed = np.flatnonzero(audio[:length] != self.audio[:length])
+        return changed[0] if len(changed) else length
+
+    def _log_mel(self, padded, count):
+        """log10 mel power of `count` frames, the first one at padded[0]."""
+        windows = sliding_window_view(padded, self.n_fft)[:: self.hop_length][:count]
+        spectrum = np.fft.rfft(windows * self.window, axis=-1).astype(np.complex64)
+        mel = self.mel_filters @ (np.abs(spectrum.T) ** 2)
+        self.computed += count
+        return np.log10(np.clip(mel, 1e-10, None))
+
+    def _store(self, frames):
+        needed = self.stable + frames.shape[1]
+        if needed > self.frames.shape[1]:
+            grown = np.empty(
+                (self.frames.shape[0], max(needed, 2 * self.frames.shape[1])),
+                dtype=np.float32,
+            )
+            grown[:, : self.stable] = self.frames[:, : self.stable]
+            self.frames = grown
+        self.frames[:, self.stable : needed] = frames
+        self.stable = needed
+
+
+class CachingFeatureExtractor:
+    """Stands in for a WhisperModel's feature_extractor.
+
+    Inside using(cache), calls from the same thread are answered by the
+    LogMelCache; every other call goes to the wrapped extractor.
+    """
+
+    def __init__(self, extractor):
+        self.extractor = extractor
+        self.local = threading.local()
+        padding = inspect.signature(extractor.__call__).parameters.get("padding")
+        # Older faster-whisper versions pad with 30 s of zeros (padding=True)
+        self.padding = (
+            padding.default if padding and type(padding.default) is int else None
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.extractor, name)
+
+    @contextmanager
+    def using(self, cache):
+        self.local.cache = cache
+        try:
+            yield
+        finally:
+            self.local.cache = None
+
+    def __call__(self, waveform, *args, chunk_length=None, **kwargs):
+        cache = getattr(self.local, "cache", None)
+        if (
+            cache is None
+            or args
+            or kwargs
+            or self.padding is None
+            or not cache.compatible(self.extractor)
+        ):
+            return self.extractor(waveform, *args, chunk_length=chunk_length, **kwargs)
+        if chunk_length is not None:  # As the wrapped extractor does
+            self.extractor.n_samples = chunk_length * self.extractor.sampling_rate
+            self.extractor.nb_max_frames = (
+                self.extractor.n_samples // self.extractor.hop_length
+            )
+        return cache.features(waveform.astype(np.float32, copy=False), self.padding)
@@ -1,7 +1,10 @@
 import configparser
+import logging
 import os
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
 DEFAULT_CONFIG = {
     "General": {
         "activation_hotkey": "ctrl+alt+d",
@@ -11,20 +14,55 @@ DEFAULT_CONFIG = {
         "compute_type": "default",
         "silence_timeout": "2.0",
         "text_inserter": "pynput",
+        "type_partials": "false",  # Type partial results and correct them in place
     },
     "Whisper": {
         "use_vad_filter": "true",
         "beam_size": "5",
         "initial_prompt": "",
+        "language_confidence": "0.8",  # Min probability to reuse detected language
+        "draft_model": "",  # Small model for partial results (blank = disabled)
+        "max_tokens_per_second": "12",  # Token budget per second of audio (0 = off)
+        "compression_ratio_threshold": "2.4",  # Above = repetitive, decode again
+        "no_speech_threshold": "0.6",  # Above (and low logprob) = silence, no text
+        "decode_deadline_factor": "3.0",  # Late after usual decode cost x this (0 = off)
+        "context_tokens": "64",  # Recent text prompting the next decode (0 = off)
+        "context_reset_sec": "10",  # Forget that text after this long without new text
     },
     "Advanced": {
         "audio_device": "",
         "sample_rate": "16000",
         "block_size": "8000",  # 0.5 seconds * 16000 Hz
+        "speech_threshold": "500",  # RMS level (int16) above which a block is speech
+        "model_idle_timeout": "0",  # Seconds before an unused model is unloaded
+        "model_dir": "",  # Model store directory (blank = XDG data dir)
+        "offline": "false",  # Only load models from the local store/cache
+        "save_history": "true",  # Keep transcripts in a searchable database
+        "history_db": "",  # Transcript database (blank = XDG data dir)
+        "log_level": "INFO",  # DEBUG also logs every inserted text
+        "log_file": "",  # Write the log to this file (blank = stderr)
+    },
+    "Output": {
+        "keyboard": "true",  # Type the text into the focused window
+        "keyboard_policy": "block",  # When an output falls behind: drop or block
+        "file": "",  # Append transcripts to this file (blank = off)
+        "file_policy": "drop",
+        "named_pipe": "",  # Write transcripts to this FIFO (blank = off)
+        "named_pipe_policy": "drop",
+        "unix_socket": "",  # Send transcripts to clients of this socket (blank = off)
+        "unix_socket_policy": "drop",
+        "queue_size": "256",  # Transcripts an output may fall behind by
+    },
+    "MultiMic": {
+        "devices": "",  # Comma-separated audio devices for multi_capture.py
+        "latency_budget": "3.0",  # Seconds from utterance end to text, per stream
+        "output_dir": "",  # Per-microphone transcripts (blank = ~/linux-dictation-transcripts)
     },
 }
 
 CONFIG_FILENAME = "config.ini"
+# Shorter blocks make the energy VAD jittery, longer ones delay endpointing
+BLOCK_SIZE_LIMITS_SEC = (0.05, 1.0)
 
 
 def get_config_path():
@@ -59,6 +97,18 @@ def save_config(config):
         config.write(configfile)
 
 
+def check_block_size(block_size, sample_rate):
+    """Returns why block_size is out of range at sample_rate, or None if it is fine."""
+    low, high = (round(limit * sample_rate) for limit in BLOCK_SIZE_LIMITS_SEC)
+    if low <= block_size <= high:
+        return None
+    return (
+        f"block_size must be {low}-{high} samples "
+        f"({BLOCK_SIZE_LIMITS_SEC[0] * 1000:.0f}-{BLOCK_SIZE_LIMITS_SEC[1] * 1000:.0f}"
+        f" ms) at {sample_rate} Hz"
+    )
+
+
 def get_setting(config, section, key, type_converter=str):
     """Helper to get a setting with type conversion."""
     try:
@@ -69,7 +119,7 @@ def get_setting(config, section, key, type_converter=str):
             return type_converter(DEFAULT_CONFIG[section][key])
         except (KeyError, ValueError):
             # Handle case where default is also missing or invalid (shouldn't happen with defined defaults)
-            print(f"Warning: Default config missing or invalid for [{section}]{key}")
+            logger.warning("Default config missing or invalid for [%s]%s", section, key)
             return None  # Or raise an error
 
 
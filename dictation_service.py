@@ -1,25 +1,299 @@
+import contextlib
+import functools
+import gc
+import logging
+import math
+import mmap
+import os
 import queue
 import subprocess  # For ydotool
 import threading
 import time
 
-import numpy as np
-import sounddevice as sd
 from faster_whisper import WhisperModel
-from pynput.keyboard import Controller as PynputController
+
+try:
+    from pynput.keyboard import Controller as PynputController
+    from pynput.keyboard import Key
+except ImportError as e:  # No X display, e.g. on a CI machine
+    _PYNPUT_ERROR = str(e)
+    Key = None
+
+    def PynputController():
+        raise RuntimeError(f"pynput is unavailable: {_PYNPUT_ERROR}")
+
+
+import config_manager
+import history_store
+import model_store
+import output_sinks
+from audio_utils import AudioBuffer, CachingFeatureExtractor, LogMelCache, is_speech
+
+logger = logging.getLogger(__name__)
 
 # Simple VAD based on energy threshold (if faster-whisper VAD isn't used or sufficient)
-SILENCE_THRESHOLD = 500  # Adjust based on microphone sensitivity
+SILENCE_THRESHOLD = 500  # Default speech_threshold (set it in the settings window)
 CHUNK_DURATION_MS = 500  # Corresponds to block_size in config
+DECODE_CHUNK_SEC = 1.0  # _stt_worker decodes once more audio than this is buffered
+# With language = auto, a cached language is dropped (and detected again) when the
+# mean log-probability of a chunk decoded with it falls below this value.
+LANGUAGE_RECHECK_LOGPROB = -1.0
+# Two-pass decoding: an utterance ends after this much silence (or at the max
+# length) and is then re-decoded by the main model.
+UTTERANCE_PAUSE_SEC = 0.6
+MAX_UTTERANCE_SEC = 20.0
+# Audio that must arrive before the draft is decoded again: about once a second
+# for the status preview, every block when partials are typed on screen.
+DRAFT_INTERVAL_SEC = 1.0
+TYPED_DRAFT_INTERVAL_SEC = 0.25
+YDOTOOL_BACKSPACE = ["14:1", "14:0"]  # KEY_BACKSPACE press + release
+# Decode budgets. On noise Whisper can repeat a phrase until its 448-token
+# window is full, and then decode again at higher temperatures.
+MIN_NEW_TOKENS = 16
+MAX_NEW_TOKENS = 200  # Leaves room for the prompt in the 448-token window
+DECODE_DEADLINE_MIN_SEC = 2.0
+DECODE_COST_SMOOTHING = 0.3  # Weight of the newest decode in the measured cost
+# faster-whisper keeps only the last 223 tokens of a prompt
+MAX_PROMPT_TOKENS = 223
+
+DECODE_STAT_LABELS = {
+    "detect": "decode with language detection",
+    "cached": "decode with fixed language",
+    "draft": "draft partial decode",
+    "final": "final decode",
+    "final_latency": "utterance end to final text",
+    "first_partial": "speech start to first partial",
+    # Streamed decodes that yield several segments: when the first one could
+    # be typed, vs. the last one (when all of them were typed before)
+    "first_segment": "decode start to first of several segments",
+    "last_segment": "decode start to last of several segments",
+}
+
+
+def transcribe_options(
+    language,
+    beam_size,
+    use_vad,
+    initial_prompt,
+    max_new_tokens=None,
+    compression_ratio_threshold=2.4,
+    no_speech_threshold=0.6,
+):
+    """Keyword arguments of the WhisperModel.transcribe calls made for dictation."""
+    return {
+        "language": language,
+        "beam_size": beam_size,
+        "vad_filter": use_vad,
+        "initial_prompt": initial_prompt,
+        "word_timestamps": False,  # Keep it simpler for now
+        "max_new_tokens": max_new_tokens,
+        "compression_ratio_threshold": compression_ratio_threshold,
+        "no_speech_threshold": no_speech_threshold,
+    }
+
+
+def token_budget(audio_seconds, tokens_per_second):
+    """max_new_tokens for a decode of audio_seconds (None = unlimited)."""
+    if tokens_per_second <= 0:
+        return None
+    window_seconds = min(audio_seconds, 30.0)  # The budget applies per window
+    return min(MIN_NEW_TOKENS + int(window_seconds * tokens_per_second), MAX_NEW_TOKENS)
+
+
+def decode_windows(audio_seconds):
+    """Number of 30 s windows Whisper encodes for audio_seconds of audio."""
+    return max(math.ceil(audio_seconds / 30.0), 1)
+
+
+def decode_deadline(expected_seconds, deadline_factor):
+    """Seconds a decode expected to take expected_seconds may take.
+
+    None = no deadline: the factor is 0, or nothing has been measured yet.
+    """
+    if deadline_factor <= 0 or expected_seconds is None:
+        return None
+    return max(expected_seconds * deadline_factor, DECODE_DEADLINE_MIN_SEC)
+
+
+def update_decode_cost(cost, seconds, audio_seconds):
+    """Folds a decode of audio_seconds that took seconds into cost.
+
+    cost is the smoothed time per 30 s window (None before the first decode):
+    Whisper encodes a full window however short the audio is.
+    """
+    window_cost = seconds / decode_windows(audio_seconds)
+    if cost is None:
+        return window_cost
+    return cost + DECODE_COST_SMOOTHING * (window_cost - cost)
+
+
+def count_tokens(model, text):
+    """Number of Whisper tokens in text, estimated if model has no tokenizer."""
+    tokenizer = getattr(model, "hf_tokenizer", None)
+    if tokenizer is None:
+        return (len(text.split()) * 3 + 1) // 2  # About 1.5 tokens per word
+    return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def decode_prompt(initial_prompt, context):
+    """The prompt of a decode: initial_prompt followed by the recent text."""
+    if initial_prompt and context:
+        return f"{initial_prompt} {context}"
+    return initial_prompt or context
+
+
+class PromptContext:
+    """Recently committed text, passed as the prompt of the next decode.
+
+    A chunk that starts mid-sentence is then decoded knowing the words
+    before it, instead of as the start of a new text. Only the latest words
+    within max_tokens are kept. The text is forgotten after reset_after
+    seconds without new text, or when the decode language changes.
+    """
+
+    def __init__(self, max_tokens, reset_after, count_tokens):
+        self.max_tokens = min(max_tokens, MAX_PROMPT_TOKENS)
+        self.reset_after = reset_after
+        self.count_tokens = count_tokens
+        self.lock = threading.Lock()  # Drafts read while the final pass commits
+        self.words = []
+        self.language = None
+        self.updated = 0.0  # When text was last committed
+
+    def commit(self, text, language, now):
+        """Adds the final text of a decode."""
+        words = text.split()
+        if not words or self.max_tokens <= 0:
+            return
+        with self.lock:
+            self._expire(language, now)
+            self.words += words
+            self.language = language or self.language
+            self.updated = now
+            del self.words[: -self.max_tokens]  # Every word is at least one token
+            while self.words and self.count_tokens(self.text()) > self.max_tokens:
+                del self.words[0]
+
+    def prompt(self, language, now):
+        """The text to prompt a decode in language with (None if there is none)."""
+        with self.lock:
+            self._expire(language, now)
+            return self.text() or None
+
+    def reset(self):
+        with self.lock:
+            self.words = []
+            self.language = None
+
+    def text(self):
+        return " ".join(self.words)
+
+    def _expire(self, language, now):
+        if not self.words:
+            return
+        changed = language and self.language and language != self.language
+        if changed or now - self.updated > self.reset_after:
+            self.words = []
+            self.language = None
+
+
+def _minimal_edit(old, new):
+    """Returns (backspaces, text to type) that turn on-screen `old` into `new`.
+
+    Only the part after the common prefix is erased and retyped.
+    """
+    prefix = 0
+    for old_char, new_char in zip(old, new):
+        if old_char != new_char:
+            break
+        prefix += 1
+    return len(old) - prefix, new[prefix:]
+
+
+def _current_rss_mb():
+    """Returns the resident set size of this process in MB (None if unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _warm_model_files(model_path):
+    """Memory-maps the model weights and asks the kernel to read them ahead.
+
+    The pages end up in the page cache, so the following WhisperModel load reads
+    the weights from RAM instead of disk.
+    """
+    weights_path = os.path.join(model_path, "model.bin")
+    if not os.path.isfile(weights_path):
+        return
+    with open(weights_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_WILLNEED)
+
+
+class SystemClock:
+    """Real time, as read and waited for by DictationService.
+
+    The service reads the time and waits for its queues, events and threads
+    only through its clock, so simulation.SimClock can replace it.
+    """
+
+    def time(self):
+        return time.time()
+
+    def perf_counter(self):
+        return time.perf_counter()
+
+    def get(self, queue_, timeout=None):
+        return queue_.get(timeout=timeout)
+
+    def wait(self, event, timeout=None):
+        return event.wait(timeout)
+
+    def join(self, thread, timeout=None):
+        thread.join(timeout)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class SoundDeviceSource:
+    """Opens int16 mono microphone streams with sounddevice."""
+
+    def open(self, samplerate, blocksize, device, callback):
+        import sounddevice as sd  # Needs PortAudio, so only when recording
+
+        return sd.InputStream(
+            samplerate=samplerate,
+            blocksize=blocksize,
+            device=device,
+            channels=1,
+            dtype="int16",  # Converted to float32 only for decoding
+            callback=callback,
+        )
 
 
 class DictationService:
-    def __init__(self, config):
+    """Captures audio while dictation is on, transcribes it and outputs the text.
+
+    clock, audio_source and model_factory default to real time, the
+    microphone and faster_whisper.WhisperModel. simulation.py replaces them
+    to run scripted dictation in virtual time.
+    """
+
+    def __init__(self, config, clock=None, audio_source=None, model_factory=None):
         self.config = config
+        self.clock = clock or SystemClock()
+        self.audio_source = audio_source or SoundDeviceSource()
+        self.model_factory = model_factory or WhisperModel
         self.status_queue = (
             queue.Queue()
         )  # To report status changes (idle, listening, processing, error)
-        self.text_queue = queue.Queue()  # To send transcribed text for insertion
+        self.sinks = []  # output_sinks.OutputSink, fed by _publish
 
         self._load_config()
 
@@ -28,16 +302,47 @@ class DictationService:
         self.audio_stream = None
         self.stt_thread = None
         self.audio_queue = queue.Queue()
-        self.last_speech_time = time.time()
+        self.last_speech_time = self.clock.time()
+        self.session_language = None  # Detected language reused while language=auto
+        self.decode_stats = {}  # DECODE_STAT_LABELS key -> (count, total seconds)
+        self.decode_timeouts = {}  # DECODE_STAT_LABELS key -> decodes past deadline
+        self.late_decodes = {}  # id(model) -> decode still running past its deadline
+        self.decode_costs = {}  # id(model) -> smoothed seconds per 30 s window
+        self.stats_lock = threading.Lock()
+        self.cancel_decodes = threading.Event()  # stop(): skip undecoded segments
+        self.text_emitted = False  # Session typed text yet (to space the next)
+        self.session_started = self.clock.time()  # Start of the current dictation
+        self.history = None  # HistoryStore, opened in start()
+        # Typed partials: utterance id -> text currently on screen, oldest first
+        self.provisional_text = {}
+        # Typed partials: utterance id -> [keystrokes issued, full retype]
+        self.keystroke_stats = {}
+        # Bytes of int16 audio captured, peak buffered, and converted to float32
+        self.capture_stats = {
+            "captured": 0,
+            "peak_buffered": 0,
+            "converted": 0,
+            "mel_computed": 0,  # Log-mel frames computed by LogMelCaches
+            "mel_served": 0,  # Log-mel frames they passed to the models
+        }
 
         self.stt_model = None  # Lazy load
+        self.draft_model = None  # Optional small model for partial results
+        self.draft_load_failed = None  # draft_model_size that failed to load
+        self.model_lock = threading.Lock()  # Serializes load/unload of stt_model
+        self.model_path = None  # Local cache directory of the loaded model
+        self.model_load_seconds = None  # Last measured load time
+        self.model_ram_mb = None  # RSS growth caused by the last load
+        self.idle_unload_timer = None
         self.pynput_kb = None
         if self.text_inserter == "pynput":
             try:
                 self.pynput_kb = PynputController()
             except Exception as e:
-                print(
-                    f"Error initializing pynput Controller: {e}. Text insertion might fail."
+                logger.error(
+                    "Error initializing pynput Controller: %s. "
+                    "Text insertion might fail.",
+                    e,
                 )
                 self.status_queue.put(("error", f"Pynput init failed: {e}"))
 
@@ -50,52 +355,263 @@ class DictationService:
         self.use_vad = self.config.getboolean("Whisper", "use_vad_filter")
         self.beam_size = self.config.getint("Whisper", "beam_size")
         self.initial_prompt = self.config.get("Whisper", "initial_prompt") or None
+        self.language_confidence = self.config.getfloat(
+            "Whisper", "language_confidence", fallback=0.8
+        )
+        self.max_tokens_per_second = self.config.getfloat(
+            "Whisper", "max_tokens_per_second", fallback=12.0
+        )
+        self.compression_ratio_threshold = self.config.getfloat(
+            "Whisper", "compression_ratio_threshold", fallback=2.4
+        )
+        self.no_speech_threshold = self.config.getfloat(
+            "Whisper", "no_speech_threshold", fallback=0.6
+        )
+        self.decode_deadline_factor = self.config.getfloat(
+            "Whisper", "decode_deadline_factor", fallback=3.0
+        )
+        self.prompt_context = PromptContext(
+            self.config.getint("Whisper", "context_tokens", fallback=64),
+            self.config.getfloat("Whisper", "context_reset_sec", fallback=10.0),
+            self._count_tokens,
+        )
+        self.draft_model_size = (
+            self.config.get("Whisper", "draft_model", fallback="") or None
+        )
+        self.type_partials = self.config.getboolean(
+            "General", "type_partials", fallback=False
+        )
         self.sample_rate = self.config.getint("Advanced", "sample_rate")
         self.block_size = self.config.getint("Advanced", "block_size")
+        problem = config_manager.check_block_size(self.block_size, self.sample_rate)
+        if problem:
+            self.block_size = int(
+                config_manager.DEFAULT_CONFIG["Advanced"]["block_size"]
+            )
+            logger.warning("%s, using %d.", problem, self.block_size)
+        self.speech_threshold = self.config.getint(
+            "Advanced", "speech_threshold", fallback=SILENCE_THRESHOLD
+        )
         self.audio_device = (
             self.config.get("Advanced", "audio_device") or None
         )  # Use None for default
         self.silence_timeout = self.config.getfloat("General", "silence_timeout")
         self.text_inserter = self.config.get("General", "text_inserter").lower()
+        self.model_idle_timeout = self.config.getfloat(
+            "Advanced", "model_idle_timeout", fallback=0.0
+        )
+        self.model_dir = model_store.get_model_dir(self.config)
+        self.offline = self.config.getboolean("Advanced", "offline", fallback=False)
+        self.save_history = self.config.getboolean(
+            "Advanced", "save_history", fallback=True
+        )
+        self.history_path = history_store.get_history_path(self.config)
+
+    def _effective_compute_type(self):
+        """Resolves compute_type = auto from the CPU features of this machine."""
+        if self.compute_type == "auto":
+            return model_store.recommended_compute_type(self.device)
+        return self.compute_type
+
+    def _resolve_model_path(self):
+        """Returns the local directory of the configured model if it is cached."""
+        if os.path.isdir(self.model_size):
+            return self.model_size
+        stored = model_store.find_model(
+            self.model_dir, self.model_size, self._effective_compute_type()
+        )
+        if stored:
+            return str(stored)
+        try:
+            from faster_whisper.utils import download_model
+
+            return download_model(self.model_size, local_files_only=True)
+        except Exception:
+            return None  # Not cached yet, WhisperModel will download it
+
+    def _cpu_thread_split(self):
+        """Returns (main, draft) CTranslate2 thread counts.
+
+        With a draft model the cores are partitioned so a long final decode can
+        never take the cores the draft pass needs. 0 = CTranslate2 default.
+        """
+        if not self.draft_model_size:
+            return 0, 0
+        cores = os.cpu_count() or 1
+        draft_threads = max(1, cores // 4)
+        return max(1, cores - draft_threads), draft_threads
 
     def _load_stt_model(self):
-        """Loads the STT model if not already loaded."""
-        if self.stt_model is None:
-            try:
-                self.status_queue.put(("processing", "Loading STT model..."))
-                print(
-                    f"Loading model: {self.model_size} ({self.device}, {self.compute_type})"
+        """Loads the STT model (and the draft model) if not already loaded."""
+        with self.model_lock:
+            if self.stt_model is None:
+                self._load_main_model()
+            if (
+                self.stt_model is not None
+                and self.draft_model_size
+                and self.draft_model is None
+                and self.draft_model_size != self.draft_load_failed
+            ):
+                self._load_draft_model()
+
+    def _load_main_model(self):
+        """Loads the configured model, preferring the model store/local cache."""
+        try:
+            self.status_queue.put(("processing", "Loading STT model..."))
+            compute_type = self._effective_compute_type()
+            logger.info(
+                "Loading model: %s (%s, %s)", self.model_size, self.device, compute_type
+            )
+            start_time = self.clock.perf_counter()
+            rss_before = _current_rss_mb()
+
+            # Prefer the local cache: warm the weights into the page cache
+            # and skip the network round-trip to the model hub.
+            model_path = self.model_path or self._resolve_model_path()
+            if model_path:
+                try:
+                    _warm_model_files(model_path)
+                except (OSError, ValueError) as e:
+                    logger.warning("Could not memory-map model weights: %s", e)
+                self.stt_model = self.model_factory(
+                    model_path,
+                    device=self.device,
+                    compute_type=compute_type,
+                    cpu_threads=self._cpu_thread_split()[0],
+                    local_files_only=True,
                 )
-                # Check ~/.cache/faster_whisper for existing models first
-                self.stt_model = WhisperModel(
-                    self.model_size, device=self.device, compute_type=self.compute_type
+            elif self.offline:
+                raise RuntimeError(
+                    f"'{self.model_size}' is not installed in {self.model_dir} "
+                    "(offline mode, run: python model_store.py install "
+                    f"{self.model_size})"
                 )
-                print("Model loaded.")
-                self.status_queue.put(
-                    ("idle", "Model loaded")
-                )  # Or back to previous state if needed
-            except Exception as e:
-                print(f"Error loading STT model: {e}")
-                self.status_queue.put(("error", f"Model load failed: {e}"))
-                self.stt_model = None  # Ensure it stays None on failure
+            else:
+                self.stt_model = self.model_factory(
+                    self.model_size,
+                    device=self.device,
+                    compute_type=compute_type,
+                    cpu_threads=self._cpu_thread_split()[0],
+                )
+                model_path = self._resolve_model_path()
+            self.model_path = model_path
+            self.stt_model.feature_extractor = CachingFeatureExtractor(
+                self.stt_model.feature_extractor
+            )
+            self.decode_costs.pop(id(self.stt_model), None)  # Measured per model
+
+            self.model_load_seconds = self.clock.perf_counter() - start_time
+            if model_path and str(model_path).startswith(str(self.model_dir)):
+                model_store.record_load_time(
+                    model_path, self.device, compute_type, self.model_load_seconds
+                )
+            rss_after = _current_rss_mb()
+            if rss_before is not None and rss_after is not None:
+                self.model_ram_mb = max(rss_after - rss_before, 0.0)
+            logger.info("Model loaded. %s", self._model_cost_summary())
+            self.status_queue.put(
+                ("idle", f"Model loaded ({self._model_cost_summary()})")
+            )  # Or back to previous state if needed
+        except Exception as e:
+            logger.error("Error loading STT model: %s", e)
+            self.status_queue.put(("error", f"Model load failed: {e}"))
+            self.stt_model = None  # Ensure it stays None on failure
+
+    def _load_draft_model(self):
+        """Loads the small model used for quick partial results."""
+        compute_type = self._effective_compute_type()
+        logger.info(
+            "Loading draft model: %s (%s, %s)",
+            self.draft_model_size,
+            self.device,
+            compute_type,
+        )
+        try:
+            self.draft_model = model_store.load_model(
+                self.model_dir,
+                self.draft_model_size,
+                compute_type,
+                self.model_factory,
+                device=self.device,
+                cpu_threads=self._cpu_thread_split()[1],
+                local_files_only=self.offline,
+            )
+            self.draft_model.feature_extractor = CachingFeatureExtractor(
+                self.draft_model.feature_extractor
+            )
+            self.decode_costs.pop(id(self.draft_model), None)
+            self.draft_load_failed = None
+            logger.info("Draft model loaded.")
+        except Exception as e:
+            logger.error("Error loading draft model: %s. Partial results disabled.", e)
+            self.status_queue.put(("error", f"Draft model load failed: {e}"))
+            self.draft_model = None
+            self.draft_load_failed = self.draft_model_size  # Until it is changed
+
+    def _model_cost_summary(self):
+        """Describes the RAM held by the model and the time it takes to reload it."""
+        parts = []
+        if self.model_ram_mb is not None:
+            parts.append(f"~{self.model_ram_mb:.0f} MB RAM")
+        if self.model_load_seconds is not None:
+            parts.append(f"load {self.model_load_seconds:.1f}s")
+        return ", ".join(parts) or "no measurements"
+
+    def prefetch_model(self):
+        """Starts loading the model in the background (e.g. on hotkey press)."""
+        if self.stt_model is not None or self.model_lock.locked():
+            return
+        self._cancel_idle_unload()
+        threading.Thread(target=self._prefetch_worker, daemon=True).start()
+
+    def _prefetch_worker(self):
+        self._load_stt_model()
+        if not self.is_dictating:
+            # Hotkey was pressed but dictation never started; don't pin the model
+            self._schedule_idle_unload()
+
+    def _schedule_idle_unload(self):
+        """(Re)starts the timer that frees the model after model_idle_timeout."""
+        self._cancel_idle_unload()
+        if self.model_idle_timeout > 0 and self.stt_model is not None:
+            self.idle_unload_timer = threading.Timer(
+                self.model_idle_timeout, self._unload_idle_model
+            )
+            self.idle_unload_timer.daemon = True
+            self.idle_unload_timer.start()
+
+    def _cancel_idle_unload(self):
+        if self.idle_unload_timer:
+            self.idle_unload_timer.cancel()
+            self.idle_unload_timer = None
+
+    def _unload_idle_model(self):
+        """Timer callback: drops the model if dictation has stayed inactive."""
+        with self.model_lock:
+            if self.is_dictating or self.stt_model is None:
+                return
+            self.stt_model = None
+            self.draft_model = None
+            gc.collect()
+        message = (
+            f"Model unloaded after {self.model_idle_timeout:.0f}s idle "
+            f"(freed {self._model_cost_summary()})"
+        )
+        logger.info(message)
+        self.status_queue.put(("idle", message))
 
     def _audio_callback(self, indata, frames, time_info, status):
         """This is called (from a separate thread) for each audio block."""
         if status:
-            print(f"Audio callback status: {status}", file=sys.stderr)
+            logger.warning("Audio callback status: %s", status)
         if self.is_dictating:
-            # Basic RMS energy VAD (optional layer)
-            rms = np.sqrt(np.mean(indata**2))
-            # print(f"RMS: {rms:.2f}") # Debug VAD
-            is_speech = rms > (
-                SILENCE_THRESHOLD / 32768.0
-            )  # Normalize threshold for float data
-
-            if is_speech:
-                self.last_speech_time = time.time()
+            # Basic energy VAD (optional layer), on the raw int16 samples
+            block = indata[:, 0]
+            if is_speech(block, self.speech_threshold):
+                self.last_speech_time = self.clock.time()
 
-            # Put audio data into the queue for the STT thread
-            self.audio_queue.put(indata.copy())
+            # Put audio data into the queue for the STT thread (int16, mono)
+            self.audio_queue.put(block.copy())
 
     def _stt_worker(self):
         """Thread worker function for running STT."""
@@ -105,30 +621,33 @@ class DictationService:
             self.status_queue.put(("idle", "Dictation stopped (model load failed)"))
             return
 
-        print("STT worker started.")
-        audio_buffer = np.array([], dtype=np.float32)
+        logger.info("STT worker started.")
+        audio_buffer = AudioBuffer()
+        buffer_start = 0  # Session sample offset of audio_buffer[0]
 
         while self.is_dictating or not self.audio_queue.empty():
             try:
                 # Get audio data, wait if necessary but with a timeout
                 try:
-                    chunk = self.audio_queue.get(timeout=0.1)
-                    audio_buffer = np.concatenate((audio_buffer, chunk))
+                    chunk = self.clock.get(self.audio_queue, 0.1)
+                    audio_buffer.append(chunk)
+                    self._record_capture(chunk, audio_buffer)
                 except queue.Empty:
                     # No new audio, check silence timeout
                     if (
                         self.is_dictating
                         and self.silence_timeout > 0
-                        and (time.time() - self.last_speech_time) > self.silence_timeout
+                        and (self.clock.time() - self.last_speech_time)
+                        > self.silence_timeout
                     ):
-                        print("Silence timeout reached.")
+                        logger.info("Silence timeout reached.")
                         self.toggle_dictation()  # Signal to stop
                         # Process any remaining buffer before exiting loop
-                        if audio_buffer.size == 0:
+                        if len(audio_buffer) == 0:
                             continue  # Nothing left to process
 
                     # If not dictating anymore, process remaining buffer then exit
-                    elif not self.is_dictating and audio_buffer.size == 0:
+                    elif not self.is_dictating and len(audio_buffer) == 0:
                         break
                     # If waiting for more audio or timeout not reached, continue loop
                     elif self.is_dictating:
@@ -141,73 +660,616 @@ class DictationService:
                 buffer_duration_sec = len(audio_buffer) / self.sample_rate
 
                 # Process if buffer is reasonably long OR if we are stopping and have data
-                should_process = buffer_duration_sec > 1.0 or (
-                    not self.is_dictating and audio_buffer.size > self.sample_rate * 0.2
+                should_process = buffer_duration_sec > DECODE_CHUNK_SEC or (
+                    not self.is_dictating and len(audio_buffer) > self.sample_rate * 0.2
                 )  # Process min 0.2s on stop
 
-                if should_process and self.stt_model:
-                    # print(f"Processing {buffer_duration_sec:.2f}s of audio...")
+                # While a decode that ran past its deadline still holds the
+                # model, keep buffering: the audio is decoded in one go later.
+                if (
+                    should_process
+                    and self.stt_model
+                    and not (self.is_dictating and self._model_busy(self.stt_model))
+                ):
+                    logger.debug("Processing %.2fs of audio...", buffer_duration_sec)
                     self.status_queue.put(("processing", "Transcribing..."))
 
-                    segments, info = self.stt_model.transcribe(
+                    buffer_end = buffer_start + len(audio_buffer)
+                    finish = functools.partial(
+                        self._finish_chunk, buffer_start, buffer_end
+                    )
+                    # Segments are typed as they are decoded
+                    full_text = self._transcribe(
+                        self.stt_model,
                         audio_buffer,
-                        language=self.language if self.language != "auto" else None,
-                        beam_size=self.beam_size,
-                        vad_filter=self.use_vad,
-                        initial_prompt=self.initial_prompt,
-                        word_timestamps=False,  # Keep it simpler for now
+                        on_segment=self._stream_segment,
+                        on_late=finish,
                     )
-
-                    full_text = ""
-                    for segment in segments:
-                        # print(f"Segment: {segment.text}")
-                        full_text += segment.text
-
-                    if full_text.strip():
-                        self.text_queue.put(
-                            full_text.lstrip()
-                        )  # Remove leading space often added
-                        self.last_speech_time = (
-                            time.time()
-                        )  # Reset silence timer on getting text
+                    if full_text is not None:
+                        finish(full_text)
 
                     # Clear buffer after processing
-                    audio_buffer = np.array([], dtype=np.float32)
+                    audio_buffer = AudioBuffer()
+                    buffer_start = buffer_end
                     self.status_queue.put(
                         ("listening", "Listening...")
                     )  # Back to listening
 
             except Exception as e:
-                print(f"Error in STT worker: {e}")
+                logger.error("Error in STT worker: %s", e)
                 self.status_queue.put(("error", f"STT Error: {e}"))
                 # Maybe add a delay or break? For now, continue.
 
-        print("STT worker finished.")
+        self._wait_late_decodes()
+        logger.info("STT worker finished.")
+        self._report_decode_stats()
+        self._report_capture_stats()
+        self._report_output_stats()
         # Ensure final state is idle if we exited loop
         if not self.is_dictating:
             self.status_queue.put(("idle", "Dictation stopped"))
+            self._schedule_idle_unload()
+
+    def _transcribe(
+        self, model, audio, kind=None, mel_cache=None, on_segment=None, on_late=None
+    ):
+        """Decodes one AudioBuffer and returns the joined segment text.
+
+        kind names the decode in decode_stats; by default it is "detect" or
+        "cached" depending on whether language detection ran. Only decodes by
+        the main model update the cached session language. mel_cache is the
+        LogMelCache of audio, for buffers that are decoded more than once.
+        on_segment is called with each segment as soon as it is decoded.
+
+        A decode still running at its deadline (decode_deadline_factor times
+        the measured cost of the model) is left to finish on its own thread
+        and None is returned; on_late then gets the text when it is done.
+        """
+        decode_language = self._decode_language()
+        if kind is None:
+            kind = "detect" if decode_language is None else "cached"
+        late = self.late_decodes.get(id(model))
+        if late is not None and not late["done"].is_set():
+            if kind == "draft":
+                return ""  # Drafts are best effort; the next one will catch up
+            self.clock.wait(late["done"])  # The model decodes one request at a time
+
+        decode_start = self.clock.perf_counter()
+        # The only int16 -> float32 conversion on the capture path
+        samples = audio.to_float32()
+        self.capture_stats["converted"] += samples.nbytes
+        audio_seconds = len(samples) / self.sample_rate
+        context = self.prompt_context.prompt(decode_language, self.clock.time())
+        options = transcribe_options(
+            decode_language,
+            self.beam_size,
+            self.use_vad,
+            decode_prompt(self.initial_prompt, context),
+            max_new_tokens=token_budget(audio_seconds, self.max_tokens_per_second),
+            compression_ratio_threshold=self.compression_ratio_threshold,
+            no_speech_threshold=self.no_speech_threshold,
+        )
+        decode = {
+            "kind": kind,
+            "model": id(model),
+            "audio_seconds": audio_seconds,
+            "started": decode_start,
+            "segments": [],
+            "segment_times": [],  # perf_counter() when each segment was decoded
+            "on_segment": on_segment,
+            "on_late": on_late,
+            "lock": threading.Lock(),  # Guards finished/late
+            "finished": False,
+            "late": False,
+            "done": threading.Event(),
+        }
+        cost = self.decode_costs.get(id(model))
+        deadline = decode_deadline(
+            None if cost is None else cost * decode_windows(audio_seconds),
+            self.decode_deadline_factor,
+        )
+        if deadline is None:
+            self._decode(model, samples, options, mel_cache, decode)
+        else:
+            threading.Thread(
+                target=self._decode,
+                args=(model, samples, options, mel_cache, decode),
+                name="decode",
+                daemon=True,
+            ).start()
+            if not self.clock.wait(decode["done"], deadline):
+                with decode["lock"]:
+                    decode["late"] = not decode["finished"]
+            if decode["late"]:
+                self.late_decodes[id(model)] = decode
+                with self.stats_lock:
+                    self.decode_timeouts[kind] = self.decode_timeouts.get(kind, 0) + 1
+                logger.warning(
+                    "%s still running after %.1fs (%.1fs of audio), "
+                    "finishing it in the background",
+                    DECODE_STAT_LABELS[kind].capitalize(),
+                    deadline,
+                    audio_seconds,
+                )
+                return None
+            self.clock.wait(decode["done"])  # Finished just at the deadline
+        if "error" in decode:
+            raise decode["error"]
+
+        segments = list(decode["segments"])
+        full_text = "".join(segment.text for segment in segments)
+        self._record_decode_time(kind, self.clock.perf_counter() - decode_start)
+        segment_times = list(decode["segment_times"])
+        if on_segment is not None and len(segment_times) > 1:
+            self._record_decode_time("first_segment", segment_times[0] - decode_start)
+            self._record_decode_time("last_segment", segment_times[-1] - decode_start)
+        doubtful = False
+        if (
+            self.language == "auto"
+            and model is self.stt_model
+            and decode.get("info") is not None
+        ):
+            doubtful = self._update_session_language(
+                decode_language,
+                decode["info"],
+                [segment.avg_logprob for segment in segments],
+            )
+        if kind != "draft" and not doubtful:
+            self._commit_context(full_text)
+        return full_text
+
+    def _commit_context(self, text):
+        """Adds the final text of a decode to the prompt of the next ones."""
+        self.prompt_context.commit(text, self._decode_language(), self.clock.time())
+
+    def _model_busy(self, model):
+        """True while a decode that ran past its deadline still holds model."""
+        late = self.late_decodes.get(id(model))
+        return late is not None and not late["done"].is_set()
+
+    def _wait_late_decodes(self):
+        """Waits for decodes past their deadline: their text ends the session."""
+        for late in list(self.late_decodes.values()):
+            self.clock.wait(late["done"])
+        self.late_decodes = {}
+
+    def _decode(self, model, samples, options, mel_cache, decode):
+        """Runs model.transcribe and collects its segments into the decode dict.
+
+        Segments are decoded lazily, one 30 s window at a time, so a cancelled
+        decode stops before decoding the next window. Each segment is passed
+        to decode["on_segment"] as soon as it is decoded. Completed decodes
+        update the measured cost of the model; a decode that ran past its
+        deadline hands its text to decode["on_late"] before it is done.
+        """
+        try:
+            if mel_cache is not None:
+                features = model.feature_extractor.using(mel_cache)
+            else:
+                features = contextlib.nullcontext()
+            with features:
+                segments, decode["info"] = model.transcribe(samples, **options)
+            for segment in segments:
+                if self.cancel_decodes.is_set():
+                    break
+                logger.debug("Segment: %s", segment.text)
+                decode["segments"].append(segment)
+                decode["segment_times"].append(self.clock.perf_counter())
+                if decode["on_segment"] is not None:
+                    decode["on_segment"](segment)
+            else:
+                self.decode_costs[decode["model"]] = update_decode_cost(
+                    self.decode_costs.get(decode["model"]),
+                    self.clock.perf_counter() - decode["started"],
+                    decode["audio_seconds"],
+                )
+        except Exception as e:
+            decode["error"] = e
+        finally:
+            with decode["lock"]:
+                decode["finished"] = True
+                late = decode["late"]
+            if late:
+                self._finish_late_decode(decode)
+            decode["done"].set()
+
+    def _finish_late_decode(self, decode):
+        """Hands the text of a decode that ran past its deadline to on_late."""
+        kind = decode["kind"]
+        self._record_decode_time(kind, self.clock.perf_counter() - decode["started"])
+        if "error" in decode:
+            logger.error(
+                "Error in %s past the deadline: %s",
+                DECODE_STAT_LABELS[kind],
+                decode["error"],
+            )
+            return
+        text = "".join(segment.text for segment in decode["segments"])
+        if kind != "draft":
+            self._commit_context(text)
+        if decode["on_late"] is None:
+            return
+        try:
+            decode["on_late"](text)
+        except Exception as e:
+            logger.error("Error handling late %s: %s", DECODE_STAT_LABELS[kind], e)
+
+    def _two_pass_stt_worker(self):
+        """STT worker that drafts partials with the draft model.
+
+        Audio is collected per utterance (ended by a short pause). While it
+        grows, the draft model re-decodes it and the partial text is shown in
+        the status, or typed on screen with type_partials. Finished utterances
+        are handed to _final_decode_worker, which decodes them with the main
+        model. Without a draft model, typed partials come from the main model.
+        """
+        self._load_stt_model()
+        if not self.stt_model:
+            self.is_dictating = False  # Stop if model failed to load
+            self.status_queue.put(("idle", "Dictation stopped (model load failed)"))
+            return
+        if not self.draft_model and not self.type_partials:
+            self._stt_worker()
+            return
+        drafter = self.draft_model or self.stt_model
+        draft_interval = (
+            TYPED_DRAFT_INTERVAL_SEC if self.type_partials else DRAFT_INTERVAL_SEC
+        )
+
+        logger.info("Two-pass STT worker started.")
+        # Per session, so a finishing session never hands over its utterances
+        final_queue = queue.Queue()
+        final_thread = threading.Thread(
+            target=self._final_decode_worker,
+            args=(final_queue,),
+            name="final-decode",
+            daemon=True,
+        )
+        final_thread.start()
+        utterance = AudioBuffer()
+        # Drafts and the final decode re-decode the growing utterance, so its
+        # log-mel frames are kept and only computed for new audio
+        mel_cache = LogMelCache(drafter.feature_extractor)
+        utterance_start = 0  # Session sample offset of utterance[0]
+        utterance_id = 0
+        speech_started_at = None  # When the first speech chunk arrived
+        has_speech = False
+        undrafted_samples = 0
+        # Pauses are counted in queued samples, not by the clock, so a worker
+        # that falls behind does not end an utterance while speech is queued
+        silent_samples = 0
+
+        while self.is_dictating or not self.audio_queue.empty():
+            try:
+                try:
+                    chunk = self.clock.get(self.audio_queue, 0.1)
+                    utterance.append(chunk)
+                    self._record_capture(chunk, utterance)
+                    undrafted_samples += len(chunk)
+                    if is_speech(chunk, self.speech_threshold):
+                        if not has_speech:
+                            speech_started_at = self.clock.perf_counter()
+                        has_speech = True
+                        silent_samples = 0
+                    else:
+                        silent_samples += len(chunk)
+                except queue.Empty:
+                    if (
+                        self.is_dictating
+                        and self.silence_timeout > 0
+                        and (self.clock.time() - self.last_speech_time)
+                        > self.silence_timeout
+                    ):
+                        logger.info("Silence timeout reached.")
+                        self.toggle_dictation()  # Signal to stop
+
+                paused = silent_samples >= UTTERANCE_PAUSE_SEC * self.sample_rate
+                stopping = not self.is_dictating and self.audio_queue.empty()
+                too_long = len(utterance) >= MAX_UTTERANCE_SEC * self.sample_rate
+
+                if len(utterance) and (paused or stopping or too_long):
+                    if has_speech:
+                        final_queue.put(
+                            (
+                                utterance,
+                                utterance_start,
+                                utterance_id,
+                                self.clock.perf_counter(),
+                                mel_cache,
+                            )
+                        )
+                        utterance_id += 1
+                    utterance_start += len(utterance)
+                    utterance = AudioBuffer()  # The final pass keeps the old one
+                    mel_cache = LogMelCache(drafter.feature_extractor)
+                    speech_started_at = None
+                    has_speech = False
+                    undrafted_samples = 0
+                    silent_samples = 0
+                elif (
+                    has_speech
+                    and undrafted_samples >= draft_interval * self.sample_rate
+                ):
+                    # Always draft the latest audio; drafts never queue up
+                    partial = (
+                        self._transcribe(drafter, utterance, "draft", mel_cache) or ""
+                    ).strip()
+                    undrafted_samples = 0
+                    if partial and self.type_partials:
+                        if speech_started_at is not None:
+                            self._record_decode_time(
+                                "first_partial",
+                                self.clock.perf_counter() - speech_started_at,
+                            )
+                            speech_started_at = None
+                        self._publish("partial", utterance_id, partial)
+                    elif partial:
+                        self.status_queue.put(("listening", f"... {partial}"))
+
+            except Exception as e:
+                logger.error("Error in STT worker: %s", e)
+                self.status_queue.put(("error", f"STT Error: {e}"))
+
+        final_queue.put(None)  # Let the final pass drain and exit
+        self.clock.join(final_thread)
+        self._wait_late_decodes()
+        logger.info("Two-pass STT worker finished.")
+        self._report_decode_stats()
+        self._report_capture_stats()
+        self._report_output_stats()
+        if not self.is_dictating:
+            self.status_queue.put(("idle", "Dictation stopped"))
+            self._schedule_idle_unload()
 
-    def _text_insertion_worker(self):
-        """Thread worker for inserting text using the chosen method."""
-        while self.is_running:
+    def _final_decode_worker(self, final_queue):
+        """Second pass: decodes the utterances queued in final_queue."""
+        while True:
+            item = self.clock.get(final_queue)
+            if item is None:
+                break
+            utterance, utterance_start, utterance_id, ended_at, mel_cache = item
+            if self.type_partials:
+                on_segment = None  # The final text replaces the typed partial
+            else:
+                on_segment = functools.partial(
+                    self._stream_segment, utterance_id=utterance_id
+                )
+            finish = functools.partial(
+                self._finish_utterance,
+                utterance_start,
+                utterance_start + len(utterance),
+                utterance_id,
+                ended_at,
+            )
             try:
-                text = self.text_queue.get(timeout=0.5)  # Wait briefly for text
-                if text:
-                    self._insert_text(text)
-                    self.text_queue.task_done()
-            except queue.Empty:
-                continue
+                text = self._transcribe(
+                    self.stt_model, utterance, "final", mel_cache, on_segment, finish
+                )
+                self.capture_stats["mel_computed"] += mel_cache.computed
+                self.capture_stats["mel_served"] += mel_cache.served
+                if text is not None:
+                    finish(text)
             except Exception as e:
-                print(f"Error inserting text: {e}")
-                self.status_queue.put(("error", f"Text insert failed: {e}"))
+                logger.error("Error in final decode: %s", e)
+                self.status_queue.put(("error", f"STT Error: {e}"))
+
+    def _finish_chunk(self, start_sample, end_sample, text):
+        """Records the text of a single-pass chunk once its decode is done."""
+        if text.strip():
+            self._emit_text(text.strip(), start_sample, end_sample)
+            self.last_speech_time = self.clock.time()  # Reset silence timer
+
+    def _finish_utterance(self, start_sample, end_sample, utterance_id, ended_at, text):
+        """Records the final text of an utterance once its decode is done."""
+        self._emit_text(text.strip(), start_sample, end_sample, utterance_id)
+        self._record_decode_time("final_latency", self.clock.perf_counter() - ended_at)
 
-    def _insert_text(self, text):
-        """Inserts text using pynput or ydotool."""
-        print(f"Inserting text: {text}")
+    def _stream_segment(self, segment, utterance_id=None):
+        """Publishes one decoded segment, spaced from the text before it."""
+        text = segment.text.strip()
         if not text:
             return
+        if self.text_emitted:
+            text = " " + text
+        self.text_emitted = True
+        self._publish("text", utterance_id, text)
+
+    def _emit_text(self, text, start_sample, end_sample, utterance_id=None):
+        """Publishes and records the final text of one decode.
+
+        The text was typed segment by segment (_stream_segment); here it goes
+        whole to the line outputs and the history. With typed partials, the
+        final text of an utterance replaces its partial on screen instead, so
+        it is published even when empty (to erase it).
+        """
+        if self.type_partials and utterance_id is not None:
+            self._publish("final", utterance_id, text)
+        if not text.strip():
+            return
+        if not (self.type_partials and utterance_id is not None):
+            self._publish("transcript", utterance_id, text)
+        history = self.history  # May be closed concurrently by stop()
+        if history:
+            history.add(
+                text,
+                self.session_started,
+                start_sample / self.sample_rate,
+                end_sample / self.sample_rate,
+            )
+
+    def _record_capture(self, chunk, buffer):
+        stats = self.capture_stats
+        stats["captured"] += chunk.nbytes
+        stats["peak_buffered"] = max(stats["peak_buffered"], buffer.nbytes)
+
+    def _report_capture_stats(self):
+        """Prints how much audio memory and conversion the session needed."""
+        stats = self.capture_stats
+        logger.info(
+            "Audio: captured %.1f MB as int16 (float32 would be %.1f MB), "
+            "peak buffer %.0f kB, converted %.1f MB to float32 for decoding",
+            stats["captured"] / 1e6,
+            stats["captured"] * 2 / 1e6,
+            stats["peak_buffered"] / 1e3,
+            stats["converted"] / 1e6,
+        )
+        if stats["mel_served"]:
+            logger.info(
+                "Log-mel features: computed %s of %s frames passed to the models "
+                "(%.0f%% reused from earlier decodes of the same utterance)",
+                stats["mel_computed"],
+                stats["mel_served"],
+                (1 - stats["mel_computed"] / stats["mel_served"]) * 100,
+            )
+
+    def _decode_language(self):
+        """Language to pass to transcribe (None lets Whisper detect it)."""
+        if self.language != "auto":
+            return self.language
+        return self.session_language
+
+    def _update_session_language(self, decode_language, info, logprobs):
+        """Caches a confidently detected language, or drops a doubtful cached one.
+
+        Returns True if the text was decoded with low confidence.
+        """
+        if decode_language is None:
+            if info.language_probability >= self.language_confidence:
+                self.session_language = info.language
+                logger.info(
+                    "Detected language '%s' (p=%.2f), reusing it for this session.",
+                    info.language,
+                    info.language_probability,
+                )
+        elif logprobs and sum(logprobs) / len(logprobs) < LANGUAGE_RECHECK_LOGPROB:
+            logger.info(
+                "Low confidence decoding as '%s', "
+                "detecting language again on the next chunk.",
+                decode_language,
+            )
+            self.session_language = None
+            self.prompt_context.reset()  # Its language may have changed
+            return True
+        return False
+
+    def _count_tokens(self, text):
+        return count_tokens(self.stt_model, text)
+
+    def _record_decode_time(self, kind, seconds):
+        with self.stats_lock:
+            count, total = self.decode_stats.get(kind, (0, 0.0))
+            self.decode_stats[kind] = (count + 1, total + seconds)
+
+    def _report_decode_stats(self):
+        """Prints the mean time of each kind of decode in this session."""
+        with self.stats_lock:
+            stats = sorted(self.decode_stats.items())
+            timeouts = dict(self.decode_timeouts)
+        for kind, (count, total) in stats:
+            late = (
+                f", {timeouts[kind]} finished past the deadline"
+                if kind in timeouts
+                else ""
+            )
+            logger.info(
+                "%s: %.0f ms avg over %s%s",
+                DECODE_STAT_LABELS[kind].capitalize(),
+                total / count * 1000,
+                count,
+                late,
+            )
+
+    def _publish(self, kind, utterance_id, text):
+        """Hands a transcript event to every output sink."""
+        for sink in self.sinks:
+            sink.submit(kind, utterance_id, text)
+
+    def _type_text(self, kind, utterance_id, text):
+        """Keyboard sink callback: types final text or updates typed partials."""
+        if kind == "text":
+            self._insert_text(text)
+        else:
+            self._apply_hypothesis(kind, utterance_id, text)
+
+    def _start_sinks(self):
+        self.sinks = output_sinks.create_sinks(self.config, self._type_text)
+        for sink in self.sinks:
+            sink.start()
+
+    def _stop_sinks(self):
+        for sink in self.sinks:
+            sink.stop()
+        self.sinks = []
+
+    def _report_output_stats(self):
+        """Prints delivery, backlog and latency metrics of each output sink."""
+        for sink in self.sinks:
+            logger.info(sink.report())
+
+    def _apply_hypothesis(self, kind, utterance_id, text):
+        """Updates the typed partial text of an utterance with minimal keystrokes.
+
+        Partials of all not yet finalized utterances are on screen back to back
+        (in utterance order, spaced like streamed segments), so the edit covers
+        their concatenation. Finals arrive in order, so a "final" always
+        commits the oldest utterance.
+        """
+        old_screen = self._provisional_screen()
+        old_text = self.provisional_text.get(utterance_id, "")
+        self.provisional_text[utterance_id] = text
+        new_screen = self._provisional_screen()
+
+        backspaces, suffix = _minimal_edit(old_screen, new_screen)
+        self._insert_text(suffix, backspaces=backspaces)
+        stats = self.keystroke_stats.setdefault(utterance_id, [0, 0])
+        stats[0] += backspaces + len(suffix)
+        stats[1] += len(old_text) + len(text)  # Erase + retype
+
+        if kind == "final":
+            del self.provisional_text[utterance_id]
+            # Committed text stays on screen, so later utterances follow a space
+            self.text_emitted = self.text_emitted or bool(text)
+            issued, retype = self.keystroke_stats.pop(utterance_id)
+            logger.info(
+                "Utterance %s typed incrementally: %s keystrokes (full retype: %s)",
+                utterance_id,
+                issued,
+                retype,
+            )
+
+    def _provisional_screen(self):
+        """The typed partials on screen, each spaced from the text before it."""
+        screen = []
+        spaced = self.text_emitted
+        for _, part in sorted(self.provisional_text.items()):
+            if part:
+                screen.append(" " + part if spaced else part)
+                spaced = True
+        return "".join(screen)
+
+    def _insert_text(self, text, backspaces=0):
+        """Inserts text using pynput or ydotool, after erasing `backspaces` chars."""
+        logger.debug("Inserting text: %s", text)
+        if not text and not backspaces:
+            return
 
         try:
+            if self.text_inserter == "ydotool":
+                # Ensure ydotool is installed and ydotoold is running
+                if backspaces:
+                    subprocess.run(
+                        ["ydotool", "key"] + YDOTOOL_BACKSPACE * backspaces, check=True
+                    )
+                if text:
+                    subprocess.run(["ydotool", "type", text], check=True)
+                return
+            if backspaces and self.pynput_kb:
+                for _ in range(backspaces):
+                    self.pynput_kb.press(Key.backspace)
+                    self.pynput_kb.release(Key.backspace)
+            if not text:
+                return
+
             if self.text_inserter == "pynput":
                 if self.pynput_kb:
                     # Add a space before inserting if the text doesn't start with one
@@ -217,12 +1279,10 @@ class DictationService:
                     self.pynput_kb.type(text)
                 else:
                     raise RuntimeError("Pynput keyboard controller not initialized.")
-            elif self.text_inserter == "ydotool":
-                # Ensure ydotool is installed and ydotoold is running
-                subprocess.run(["ydotool", "type", text], check=True)
             else:
-                print(
-                    f"Warning: Unknown text_inserter '{self.text_inserter}'. Defaulting to pynput."
+                logger.warning(
+                    "Unknown text_inserter '%s'. Defaulting to pynput.",
+                    self.text_inserter,
                 )
                 if self.pynput_kb:
                     self.pynput_kb.type(text)
@@ -237,49 +1297,59 @@ class DictationService:
 
         except FileNotFoundError:
             if self.text_inserter == "ydotool":
-                print(
-                    "Error: 'ydotool' command not found. Is it installed and in PATH?"
+                logger.error(
+                    "'ydotool' command not found. Is it installed and in PATH?"
                 )
                 self.status_queue.put(("error", "ydotool not found"))
             else:  # Should not happen for pynput unless internal error
                 raise
         except subprocess.CalledProcessError as e:
-            print(f"Error executing ydotool: {e}. Is ydotoold running?")
+            logger.error("Error executing ydotool: %s. Is ydotoold running?", e)
             self.status_queue.put(("error", f"ydotool failed: {e}"))
         except Exception as e:
-            print(f"General error during text insertion ({self.text_inserter}): {e}")
+            logger.error(
+                "General error during text insertion (%s): %s", self.text_inserter, e
+            )
             self.status_queue.put(("error", f"Insert failed: {e}"))
 
     def start(self):
         """Starts the background services (text insertion)."""
-        print("Starting Dictation Service...")
+        logger.info("Starting Dictation Service...")
         self.is_running = True
-        # Start text insertion thread
-        self.text_insert_thread = threading.Thread(
-            target=self._text_insertion_worker, daemon=True
-        )
-        self.text_insert_thread.start()
+        self._start_sinks()  # One thread per output (keyboard, file, ...)
+        self._open_history()
         self.status_queue.put(("idle", "Ready"))
 
+    def _open_history(self):
+        """Starts the transcript history writer if history is enabled."""
+        if self.save_history:
+            self.history = history_store.HistoryStore(self.history_path)
+            self.history.start()
+
+    def _close_history(self):
+        if self.history:
+            self.history.close()
+            self.history = None
+
     def stop(self):
         """Stops all services and threads."""
-        print("Stopping Dictation Service...")
+        logger.info("Stopping Dictation Service...")
         if self.is_dictating:
             self.toggle_dictation()  # Stop dictation first
+        self.cancel_decodes.set()  # Don't type segments that are not decoded yet
 
         self.is_running = False
+        self._cancel_idle_unload()
         # Wait briefly for threads to notice the flag
-        time.sleep(0.2)
-
-        # Signal queues if needed (e.g., put None to unblock) - less critical with timeouts/daemon threads
-        # self.text_queue.put(None) # If text_insert_thread waits indefinitely
-
-        if self.text_insert_thread and self.text_insert_thread.is_alive():
-            self.text_insert_thread.join(timeout=1.0)
+        self.clock.sleep(0.2)
 
         # STT thread should stop when is_dictating becomes false and queue is empty
         if self.stt_thread and self.stt_thread.is_alive():
-            self.stt_thread.join(timeout=1.0)
+            self.clock.join(self.stt_thread, 1.0)
+
+        self._stop_sinks()  # Delivers what the STT thread queued
+
+        self._close_history()  # Flush transcripts written by the STT thread
 
         # Clean up audio stream if it's somehow still open
         if self.audio_stream:
@@ -288,56 +1358,80 @@ class DictationService:
                     self.audio_stream.stop()
                     self.audio_stream.close()
             except Exception as e:
-                print(f"Error closing audio stream: {e}")
+                logger.error("Error closing audio stream: %s", e)
             self.audio_stream = None
 
-        print("Dictation Service stopped.")
+        logger.info("Dictation Service stopped.")
         self.status_queue.put(("offline", "Stopped"))
 
     def toggle_dictation(self):
         """Starts or stops the dictation process."""
         if not self.is_running:
-            print("Service not running. Cannot toggle dictation.")
+            logger.warning("Service not running. Cannot toggle dictation.")
             return
 
         if not self.is_dictating:
             # --- Start Dictation ---
+            if self.stt_thread and self.stt_thread.is_alive():
+                # Its final decodes still use the screen model, stats and
+                # utterance ids that a new session would reset
+                logger.warning("Previous session still finishing, not starting.")
+                self.status_queue.put(
+                    ("processing", "Still finishing the last session, try again")
+                )
+                return
+            self._cancel_idle_unload()
             if not self.stt_model:  # Lazy load model on first activation
                 self._load_stt_model()
                 if not self.stt_model:  # Check if loading failed
-                    print("Cannot start dictation: STT model failed to load.")
+                    logger.error("Cannot start dictation: STT model failed to load.")
                     # status_queue already updated by _load_stt_model on error
                     return
 
             try:
-                print("Starting dictation...")
-                self.last_speech_time = time.time()  # Reset silence timer
+                logger.info("Starting dictation...")
+                self.last_speech_time = self.clock.time()  # Reset silence timer
+                self.session_language = None  # Detect language again per session
+                self.session_started = self.clock.time()
+                self.provisional_text = {}
+                self.keystroke_stats = {}
+                self.capture_stats = dict.fromkeys(self.capture_stats, 0)
+                self.decode_stats = {}
+                self.decode_timeouts = {}
+                self.prompt_context.reset()  # The text may go somewhere else now
+                self.cancel_decodes.clear()
+                self.text_emitted = False
                 # Clear queues
                 while not self.audio_queue.empty():
                     self.audio_queue.get_nowait()
-                while not self.text_queue.empty():
-                    self.text_queue.get_nowait()
+                for sink in self.sinks:
+                    sink.clear()
 
-                self.audio_stream = sd.InputStream(
+                self.audio_stream = self.audio_source.open(
                     samplerate=self.sample_rate,
                     blocksize=self.block_size,
                     device=self.audio_device,
-                    channels=1,
-                    dtype="float32",
                     callback=self._audio_callback,
                 )
                 self.audio_stream.start()
                 self.is_dictating = True
 
                 # Start STT worker thread
-                self.stt_thread = threading.Thread(target=self._stt_worker, daemon=True)
+                worker = (
+                    self._two_pass_stt_worker
+                    if self.draft_model_size or self.type_partials
+                    else self._stt_worker
+                )
+                self.stt_thread = threading.Thread(
+                    target=worker, name="stt-worker", daemon=True
+                )
                 self.stt_thread.start()
 
                 self.status_queue.put(("listening", "Listening..."))
-                print("Dictation active.")
+                logger.info("Dictation active.")
 
             except Exception as e:
-                print(f"Error starting audio stream: {e}")
+                logger.error("Error starting audio stream: %s", e)
                 self.status_queue.put(("error", f"Audio start failed: {e}"))
                 if self.audio_stream:
                     try:
@@ -348,7 +1442,7 @@ class DictationService:
                 self.is_dictating = False  # Ensure state is correct
         else:
             # --- Stop Dictation ---
-            print("Stopping dictation...")
+            logger.info("Stopping dictation...")
             self.is_dictating = False  # Signal threads to stop
 
             if self.audio_stream:
@@ -356,12 +1450,12 @@ class DictationService:
                     if not self.audio_stream.closed:
                         self.audio_stream.stop()
                         self.audio_stream.close()
-                    print("Audio stream stopped and closed.")
+                    logger.info("Audio stream stopped and closed.")
                 except Exception as e:
-                    print(f"Error stopping/closing audio stream: {e}")
+                    logger.error("Error stopping/closing audio stream: %s", e)
                 self.audio_stream = None
             else:
-                print("Audio stream was already None.")
+                logger.debug("Audio stream was already None.")
 
             # STT thread will finish processing remaining audio and exit
             # Text insertion thread keeps running
@@ -372,7 +1466,7 @@ class DictationService:
 
     def reload_config(self, new_config):
         """Reloads configuration, restarting components if necessary."""
-        print("Reloading configuration...")
+        logger.info("Reloading configuration...")
         was_dictating = self.is_dictating
         if was_dictating:
             self.toggle_dictation()  # Stop current dictation cleanly
@@ -381,36 +1475,63 @@ class DictationService:
         old_model = self.model_size
         old_device = self.device
         old_compute = self.compute_type
+        old_model_dir = self.model_dir
+        old_draft = self.draft_model_size
+        old_history = (self.save_history, self.history_path)
         old_audio_dev = self.audio_device
         old_inserter = self.text_inserter
+        old_outputs = dict(self.config.items("Output"))
 
         self.config = new_config
         self._load_config()  # Update internal variables
+        self.session_language = None  # Language setting may have changed
 
         # Check if model needs reloading
         if (
             self.model_size != old_model
             or self.device != old_device
             or self.compute_type != old_compute
+            or self.model_dir != old_model_dir
         ):
-            print("STT configuration changed, unloading model.")
+            logger.info("STT configuration changed, unloading model.")
+            self._cancel_idle_unload()
             self.stt_model = None  # Force reload on next use/start
+            self.draft_model = None
+            self.model_path = None
+        elif self.draft_model_size != old_draft:
+            logger.info("Draft model changed, unloading it.")
+            self.draft_model = None
+
+        if (self.save_history, self.history_path) != old_history and self.is_running:
+            self._close_history()
+            self._open_history()
+
+        if dict(self.config.items("Output")) != old_outputs and self.is_running:
+            self._stop_sinks()
+            self._start_sinks()
 
         # Check if text inserter needs re-initialization
         if self.text_inserter != old_inserter or self.text_inserter == "pynput":
-            print(f"Text inserter changed to {self.text_inserter}. Re-initializing.")
+            logger.info(
+                "Text inserter changed to %s. Re-initializing.", self.text_inserter
+            )
             self.pynput_kb = None  # Clear old one
             if self.text_inserter == "pynput":
                 try:
                     self.pynput_kb = PynputController()
                 except Exception as e:
-                    print(f"Error re-initializing pynput Controller: {e}.")
+                    logger.error("Error re-initializing pynput Controller: %s.", e)
                     self.status_queue.put(("error", f"Pynput init failed: {e}"))
 
         # Check if audio device changed (requires restart if active)
         # Restarting is handled by stopping/starting toggle if was_dictating
 
-        print("Configuration reloaded.")
+        if self.model_idle_timeout > 0 and not self.is_dictating:
+            self._schedule_idle_unload()
+        elif self.model_idle_timeout <= 0:
+            self._cancel_idle_unload()
+
+        logger.info("Configuration reloaded.")
         self.status_queue.put(("idle", "Config reloaded"))
 
         # Optional: Immediately try to reload the model if not lazy loading
@@ -1,7 +1,25 @@
+import queue
+import threading
+import time
 import tkinter as tk
 from tkinter import messagebox, ttk
 
+import sounddevice as sd
+
 import config_manager
+import history_store
+import model_store
+import sweep
+from audio_utils import LevelMeter, to_dbfs
+
+METER_WIDTH = 300
+METER_MIN_DB = -70.0  # Left end of the level meter
+METER_INTERVAL_MS = 100  # Meter block length and redraw interval
+NOISE_FLOOR_MARGIN = 3.0  # Suggested threshold = noise floor x this (~10 dB)
+
+
+def _to_bool(value):
+    return str(value).strip().lower() in ("1", "yes", "true", "on")
 
 
 class ConfigWindow:
@@ -15,6 +33,14 @@ class ConfigWindow:
 
         # Variables to hold settings
         self.vars = {}
+        self.validators = {}  # (section, key) -> function returning an error or None
+        self.sample_rate = config_manager.get_setting(
+            config, "Advanced", "sample_rate", int
+        )
+        self.meter = LevelMeter()
+        self.meter_stream = None
+        self.benchmark_results = queue.Queue()  # Filled by the benchmark thread
+        self.poll_jobs = {}  # Pending after() callbacks, cancelled on close
 
         # Create sections (Frames)
         general_frame = ttk.LabelFrame(self.window, text="General", padding="10")
@@ -26,6 +52,9 @@ class ConfigWindow:
         advanced_frame = ttk.LabelFrame(self.window, text="Advanced", padding="10")
         advanced_frame.grid(row=2, column=0, padx=10, pady=5, sticky="ew")
 
+        mic_frame = ttk.LabelFrame(self.window, text="Microphone", padding="10")
+        mic_frame.grid(row=3, column=0, padx=10, pady=5, sticky="ew")
+
         # --- General Settings ---
         self._add_entry(general_frame, "activation_hotkey", "Activation Hotkey:", 0)
         self._add_entry(
@@ -47,34 +76,33 @@ class ConfigWindow:
         )
 
         # --- Whisper Settings ---
-        # Consider adding more model options if needed
-        models = [
-            "tiny",
-            "tiny.en",
-            "base",
-            "base.en",
-            "small",
-            "small.en",
-            "medium",
-            "medium.en",
-            "large-v3",
-            "distil-large-v2",
-        ]
-        self._add_combobox(
-            whisper_frame, "model_size", "Model Size:", models, 0, section="Whisper"
-        )
-        self._add_combobox(
-            whisper_frame, "device", "Device:", ["cpu", "cuda"], 1, section="Whisper"
+        # Only offer models that are installed in the model store or already
+        # cached, so picking one never triggers a download
+        models = model_store.available_models(
+            model_store.get_model_dir(config),
+            config_manager.get_setting(config, "Advanced", "offline", _to_bool),
         )
+        current_model = config_manager.get_setting(config, "General", "model_size")
+        if current_model and current_model not in models:
+            models.append(current_model)
+        # model_size, device and compute_type live in [General]
+        self._add_combobox(whisper_frame, "model_size", "Model Size:", models, 0)
+        self._add_combobox(whisper_frame, "device", "Device:", ["cpu", "cuda"], 1)
         # Common compute types - add more if needed
-        compute_types = ["default", "int8", "int8_float16", "float16", "float32"]
+        compute_types = [
+            "default",
+            "auto",
+            "int8",
+            "int8_float16",
+            "float16",
+            "float32",
+        ]
         self._add_combobox(
             whisper_frame,
             "compute_type",
             "Compute Type:",
             compute_types,
             2,
-            section="Whisper",
         )
         self._add_checkbutton(
             whisper_frame,
@@ -99,6 +127,16 @@ class ConfigWindow:
             section="Whisper",
             width=40,
         )
+        self.benchmark_button = ttk.Button(
+            whisper_frame, text="Benchmark This Model", command=self._start_benchmark
+        )
+        self.benchmark_button.grid(row=6, column=0, padx=5, pady=2, sticky="w")
+        self.benchmark_var = tk.StringVar(
+            value=f"Times a {sweep.REFERENCE_CLIP_SEC:.0f} s reference clip"
+        )
+        ttk.Label(whisper_frame, textvariable=self.benchmark_var).grid(
+            row=6, column=1, padx=5, pady=2, sticky="w"
+        )
 
         # --- Advanced Settings ---
         self._add_entry(
@@ -108,18 +146,65 @@ class ConfigWindow:
             0,
             section="Advanced",
         )
-        # self._add_entry(advanced_frame, "sample_rate", "Sample Rate (Hz):", 1, section='Advanced', type_converter=int) # Usually fixed for Whisper
-        # self._add_entry(advanced_frame, "block_size", "Audio Block Size (samples):", 2, section='Advanced', type_converter=int) # Usually fixed
+        # sample_rate stays fixed: Whisper expects 16 kHz
+        self._add_entry(
+            advanced_frame,
+            "block_size",
+            "Audio Block Size (samples):",
+            1,
+            section="Advanced",
+            type_converter=int,
+        )
+        self.validators[("Advanced", "block_size")] = (
+            lambda value: config_manager.check_block_size(value, self.sample_rate)
+        )
+        self.block_size_hint = tk.StringVar()
+        ttk.Label(advanced_frame, textvariable=self.block_size_hint).grid(
+            row=2, column=1, padx=5, sticky="w"
+        )
+        self.vars["Advanced"]["block_size"][0].trace_add(
+            "write", self._update_block_size_hint
+        )
+
+        # --- Microphone ---
+        self.meter_canvas = tk.Canvas(
+            mic_frame, width=METER_WIDTH, height=14, highlightthickness=0
+        )
+        self.meter_canvas.grid(row=0, column=0, columnspan=2, padx=5, pady=2)
+        self.level_var = tk.StringVar(value="Test the microphone to see its level")
+        ttk.Label(mic_frame, textvariable=self.level_var).grid(
+            row=1, column=0, columnspan=2, padx=5, pady=2, sticky="w"
+        )
+        self._add_entry(
+            mic_frame,
+            "speech_threshold",
+            "Speech Threshold (RMS level):",
+            2,
+            section="Advanced",
+            type_converter=int,
+        )
+        self.validators[("Advanced", "speech_threshold")] = lambda value: (
+            None if 0 < value < 32768 else "speech_threshold must be 1-32767"
+        )
+        mic_buttons = ttk.Frame(mic_frame)
+        mic_buttons.grid(row=3, column=0, columnspan=2, pady=2)
+        self.meter_button = ttk.Button(
+            mic_buttons, text="Test Microphone", command=self._toggle_meter
+        )
+        self.meter_button.pack(side=tk.LEFT, padx=5)
+        ttk.Button(
+            mic_buttons,
+            text="Set Above Noise Floor",
+            command=self._threshold_from_floor,
+        ).pack(side=tk.LEFT, padx=5)
 
         # --- Save/Cancel Buttons ---
         button_frame = ttk.Frame(self.window, padding="10")
-        button_frame.grid(row=3, column=0, pady=10)
+        button_frame.grid(row=4, column=0, pady=10)
 
         save_button = ttk.Button(button_frame, text="Save", command=self.save_settings)
         save_button.pack(side=tk.LEFT, padx=5)
-        cancel_button = ttk.Button(
-            button_frame, text="Cancel", command=self.window.destroy
-        )
+        cancel_button = ttk.Button(button_frame, text="Cancel", command=self.close)
         cancel_button.pack(side=tk.LEFT, padx=5)
 
         self.window.columnconfigure(0, weight=1)  # Allow frame to expand horizontally
@@ -142,6 +227,15 @@ class ConfigWindow:
         self.window.geometry(f"+{x}+{y}")
         self.window.transient(parent)  # Keep on top of parent
         self.window.grab_set()  # Modal behavior
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+    def close(self):
+        """Stops the level meter and closes the window (a benchmark is abandoned)."""
+        self._stop_meter()
+        for job in self.poll_jobs.values():
+            self.window.after_cancel(job)
+        self.poll_jobs = {}
+        self.window.destroy()
 
     def _add_widget(self, frame, key, label_text, row, section="General"):
         ttk.Label(frame, text=label_text).grid(
@@ -219,6 +313,13 @@ class ConfigWindow:
                             f"Invalid value for '{key}': '{value}'. Please enter a valid {type_converter.__name__}.",
                         )
                         return  # Stop saving
+                    validator = self.validators.get((section, key))
+                    problem = validator and validator(type_converter(value))
+                    if problem:
+                        messagebox.showerror(
+                            "Invalid Input", problem, parent=self.window
+                        )
+                        return
 
                     self.config.set(section, key, str(value))
 
@@ -234,13 +335,200 @@ class ConfigWindow:
                 "Settings saved successfully. Some changes may require restarting the application or dictation.",
                 parent=self.window,
             )
-            self.window.destroy()
+            self.close()
 
         except Exception as e:
             messagebox.showerror(
                 "Error Saving", f"Failed to save settings: {e}", parent=self.window
             )
 
+    def _update_block_size_hint(self, *args):
+        try:
+            block_size = int(self.vars["Advanced"]["block_size"][0].get())
+        except ValueError:
+            self.block_size_hint.set("Enter a whole number of samples")
+            return
+        problem = config_manager.check_block_size(block_size, self.sample_rate)
+        self.block_size_hint.set(
+            problem
+            or f"= {block_size / self.sample_rate * 1000:.0f} ms of audio per block"
+        )
+
+    def _speech_threshold(self):
+        try:
+            return int(self.vars["Advanced"]["speech_threshold"][0].get())
+        except ValueError:
+            return None
+
+    def _toggle_meter(self):
+        if self.meter_stream:
+            self._stop_meter()
+            self.level_var.set("Test the microphone to see its level")
+            return
+        device = self.vars["Advanced"]["audio_device"][0].get() or None
+        try:
+            self.meter_stream = sd.InputStream(
+                samplerate=self.sample_rate,
+                blocksize=self.sample_rate * METER_INTERVAL_MS // 1000,
+                device=device,
+                channels=1,
+                dtype="int16",
+                callback=lambda indata, *args: self.meter.update(indata[:, 0]),
+            )
+            self.meter_stream.start()
+        except Exception as e:
+            self.meter_stream = None
+            self.level_var.set(f"Could not open the microphone: {e}")
+            return
+        self.meter.levels.clear()
+        self.meter_button.configure(text="Stop Test")
+        self._draw_meter()
+
+    def _stop_meter(self):
+        if self.meter_stream:
+            self.meter_stream.stop()
+            self.meter_stream.close()
+            self.meter_stream = None
+            self.meter_button.configure(text="Test Microphone")
+        job = self.poll_jobs.pop("meter", None)
+        if job:
+            self.window.after_cancel(job)
+
+    def _draw_meter(self):
+        """Redraws the level bar with noise floor (blue) and threshold (red) marks."""
+
+        def x(level):
+            fraction = (to_dbfs(level) - METER_MIN_DB) / -METER_MIN_DB
+            return min(max(fraction, 0.0), 1.0) * METER_WIDTH
+
+        level, floor = self.meter.level, self.meter.noise_floor
+        threshold = self._speech_threshold()
+        canvas = self.meter_canvas
+        canvas.delete("all")
+        canvas.create_rectangle(0, 0, METER_WIDTH, 14, fill="#dddddd", width=0)
+        speech = threshold is not None and level > threshold
+        canvas.create_rectangle(
+            0, 0, x(level), 14, fill="#3a3" if speech else "#888888", width=0
+        )
+        canvas.create_line(x(floor), 0, x(floor), 14, fill="blue", width=2)
+        if threshold is not None:
+            canvas.create_line(x(threshold), 0, x(threshold), 14, fill="red", width=2)
+        self.level_var.set(
+            f"Level {level:.0f} ({to_dbfs(level):.0f} dBFS), noise floor "
+            f"{floor:.0f} ({to_dbfs(floor):.0f} dBFS)" + (" - speech" if speech else "")
+        )
+        self.poll_jobs["meter"] = self.window.after(METER_INTERVAL_MS, self._draw_meter)
+
+    def _threshold_from_floor(self):
+        if not self.meter.levels:
+            self.level_var.set("Test the microphone first, without speaking")
+            return
+        threshold = max(round(self.meter.noise_floor * NOISE_FLOOR_MARGIN), 1)
+        self.vars["Advanced"]["speech_threshold"][0].set(str(threshold))
+
+    def _start_benchmark(self):
+        model_size = self.vars["General"]["model_size"][0].get()
+        compute_type = self.vars["General"]["compute_type"][0].get()
+        try:
+            beam_size = int(self.vars["Whisper"]["beam_size"][0].get())
+        except ValueError:
+            self.benchmark_var.set("Enter a valid beam size first")
+            return
+        self.benchmark_button.state(["disabled"])
+        self.benchmark_var.set(f"Benchmarking {model_size} ({compute_type})...")
+
+        # Loading and decoding take seconds, so keep them off the Tk thread
+        def run():
+            try:
+                result = sweep.benchmark_model(
+                    self.config, model_size, compute_type, beam_size
+                )
+            except Exception as e:
+                result = e
+            self.benchmark_results.put(result)
+
+        threading.Thread(target=run, name="benchmark", daemon=True).start()
+        self._poll_benchmark()
+
+    def _poll_benchmark(self):
+        try:
+            result = self.benchmark_results.get_nowait()
+        except queue.Empty:
+            self.poll_jobs["benchmark"] = self.window.after(200, self._poll_benchmark)
+            return
+        self.poll_jobs.pop("benchmark", None)
+        self.benchmark_button.state(["!disabled"])
+        if isinstance(result, Exception):
+            self.benchmark_var.set(f"Benchmark failed: {result}")
+        else:
+            self.benchmark_var.set(
+                f"Real-time factor {result['rtf']:.2f} "
+                f"({result['decode_seconds']:.1f} s for "
+                f"{sweep.REFERENCE_CLIP_SEC:.0f} s), load {result['load_seconds']:.1f} s,"
+                f" {result['words']} words"
+            )
+
+
+class HistoryWindow:
+    """Searches the transcript history as the user types."""
+
+    def __init__(self, parent, config):
+        self.history_path = history_store.get_history_path(config)
+        self.pending_search = None
+
+        self.window = tk.Toplevel(parent)
+        self.window.title("Dictation History")
+        self.window.geometry("700x400")
+
+        self.query_var = tk.StringVar()
+        entry = ttk.Entry(self.window, textvariable=self.query_var)
+        entry.grid(row=0, column=0, padx=10, pady=5, sticky="ew")
+        entry.focus_set()
+        self.query_var.trace_add("write", self._schedule_search)
+
+        self.results = ttk.Treeview(
+            self.window, columns=("when", "text"), show="headings"
+        )
+        self.results.heading("when", text="When")
+        self.results.heading("text", text="Text")
+        self.results.column("when", width=130, stretch=False)
+        self.results.grid(row=1, column=0, padx=10, pady=5, sticky="nsew")
+        scrollbar = ttk.Scrollbar(
+            self.window, orient=tk.VERTICAL, command=self.results.yview
+        )
+        scrollbar.grid(row=1, column=1, sticky="ns")
+        self.results.configure(yscrollcommand=scrollbar.set)
+
+        self.status_var = tk.StringVar(value="Type to search")
+        ttk.Label(self.window, textvariable=self.status_var).grid(
+            row=2, column=0, padx=10, pady=5, sticky="w"
+        )
+
+        self.window.columnconfigure(0, weight=1)
+        self.window.rowconfigure(1, weight=1)
+        self.window.transient(parent)
+
+    def _schedule_search(self, *args):
+        # Debounce keystrokes so fast typing runs only one query
+        if self.pending_search:
+            self.window.after_cancel(self.pending_search)
+        self.pending_search = self.window.after(150, self._search)
+
+    def _search(self):
+        self.pending_search = None
+        self.results.delete(*self.results.get_children())
+        start_time = time.perf_counter()
+        try:
+            rows = history_store.search(self.history_path, self.query_var.get())
+        except Exception as e:
+            self.status_var.set(f"Search failed: {e}")
+            return
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        for created, audio_start, text in rows:
+            stamp = time.strftime("%Y-%m-%d %H:%M", time.localtime(created))
+            self.results.insert("", tk.END, values=(stamp, text))
+        self.status_var.set(f"{len(rows)} results in {elapsed_ms:.0f} ms")
+
 
 # Example usage (for testing GUI standalone)
 if __name__ == "__main__":
@@ -0,0 +1,211 @@
+import argparse
+import logging
+import os
+import queue
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import config_manager
+import log_manager
+
+logger = logging.getLogger(__name__)
+
+HISTORY_FILENAME = "history.sqlite3"
+BATCH_SIZE = 500  # Max rows per write transaction
+BATCH_WAIT_SEC = 0.5  # How long the writer waits to fill a batch
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcripts (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    session_started REAL NOT NULL,
+    audio_start REAL NOT NULL,
+    audio_end REAL NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts USING fts5(
+    text, content='transcripts', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS transcripts_ai AFTER INSERT ON transcripts BEGIN
+    INSERT INTO transcripts_fts(rowid, text) VALUES (new.id, new.text);
+END;
+"""
+
+
+def default_history_path():
+    """Gets the default location of the transcript database."""
+    return (
+        Path(os.environ.get("XDG_DATA_HOME", Path.home() / ".local" / "share"))
+        / "linux-dictation"
+        / HISTORY_FILENAME
+    )
+
+
+def get_history_path(config):
+    """Returns the configured database path (blank = default)."""
+    configured = config_manager.get_setting(config, "Advanced", "history_db")
+    return Path(configured).expanduser() if configured else default_history_path()
+
+
+def _connect(path):
+    connection = sqlite3.connect(str(path))
+    connection.execute("PRAGMA journal_mode=WAL")  # Readers don't block the writer
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def _fts_query(text):
+    """Turns free text into an FTS5 query: all words, last one as a prefix."""
+    words = text.split()
+    if not words:
+        return None
+    quoted = ['"' + word.replace('"', '""') + '"' for word in words]
+    quoted[-1] += "*"  # Match while the user is still typing the word
+    return " ".join(quoted)
+
+
+def search(path, text, limit=100):
+    """Returns (created, audio_start, text) of the newest transcripts matching text."""
+    query = _fts_query(text)
+    if query is None or not Path(path).exists():
+        return []
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        # Newest first: FTS5 walks its rowid index backwards and stops at limit,
+        # instead of ranking every match like ORDER BY rank would.
+        return connection.execute(
+            "SELECT t.created, t.audio_start, t.text FROM transcripts_fts f "
+            "JOIN transcripts t ON t.id = f.rowid "
+            "WHERE transcripts_fts MATCH ? ORDER BY f.rowid DESC LIMIT ?",
+            (query, limit),
+        ).fetchall()
+    finally:
+        connection.close()
+
+
+class HistoryStore:
+    """Writes transcripts to SQLite from a background thread in batches."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.pending = queue.Queue()
+        self.writer_thread = None
+
+    def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.writer_thread = threading.Thread(target=self._writer, daemon=True)
+        self.writer_thread.start()
+
+    def add(self, text, session_started, audio_start, audio_end, created=None):
+        """Queues a transcript; never blocks the caller on disk I/O."""
+        self.pending.put(
+            (created or time.time(), session_started, audio_start, audio_end, text)
+        )
+
+    def close(self):
+        """Flushes queued transcripts and stops the writer."""
+        if self.writer_thread and self.writer_thread.is_alive():
+            self.pending.put(None)
+            self.writer_thread.join(timeout=5.0)
+        self.writer_thread = None
+
+    def _writer(self):
+        try:
+            connection = _connect(self.path)
+        except sqlite3.Error as e:
+            logger.error("Error opening transcript history %s: %s", self.path, e)
+            return
+        running = True
+        while running:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + BATCH_WAIT_SEC
+            while batch[-1] is not None and len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(
+                        self.pending.get(timeout=max(deadline - time.monotonic(), 0))
+                    )
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                running = False
+                batch.pop()
+            if not batch:
+                continue
+            try:
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO transcripts "
+                        "(created, session_started, audio_start, audio_end, text) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        batch,
+                    )
+            except sqlite3.Error as e:
+                logger.error("Error writing transcript history: %s", e)
+        connection.close()
+
+
+def benchmark(rows, path=None):
+    """Measures write throughput and query latency on a database of `rows` rows."""
+    words = (
+        "the quick brown fox jumps over lazy dog meeting notes project deadline "
+        "review budget schedule customer release server update report draft "
+        "morning afternoon tomorrow yesterday please send call email"
+    ).split()
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = Path(path) if path else Path(tmp_dir) / HISTORY_FILENAME
+        store = HistoryStore(db_path)
+        store.start()
+        start_time = time.perf_counter()
+        now = time.time()
+        for i in range(rows):
+            text = " ".join(rng.choices(words, k=12))
+            store.add(text, now, i * 2.0, i * 2.0 + 1.5, created=now + i)
+        store.close()
+        elapsed = time.perf_counter() - start_time
+        print(f"Wrote {rows} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)")
+
+        for query in ("budget", "quick brown", "deadl", "customer release report"):
+            latencies = []
+            for _ in range(20):
+                query_start = time.perf_counter()
+                results = search(db_path, query, limit=100)
+                latencies.append((time.perf_counter() - query_start) * 1000)
+            latencies.sort()
+            print(
+                f"Query {query!r}: {len(results)} results, "
+                f"p50 {latencies[len(latencies) // 2]:.1f} ms, "
+                f"max {latencies[-1]:.1f} ms"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Search or benchmark transcript history."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    search_parser = commands.add_parser("search", help="Search the history")
+    search_parser.add_argument("text")
+    search_parser.add_argument("--limit", type=int, default=20)
+    bench = commands.add_parser("bench", help="Benchmark writes and queries")
+    bench.add_argument("--rows", type=int, default=1_000_000)
+    bench.add_argument("--db", help="Database file to use (default: temporary)")
+    args = parser.parse_args()
+    log_manager.setup_logging()
+
+    if args.command == "search":
+        path = get_history_path(config_manager.load_config())
+        for created, audio_start, text in search(path, args.text, args.limit):
+            stamp = time.strftime("%Y-%m-%d %H:%M", time.localtime(created))
+            print(f"{stamp} (+{audio_start:.1f}s)  {text}")
+    elif args.command == "bench":
+        benchmark(args.rows, args.db)
+
+
+if __name__ == "__main__":
+    main()
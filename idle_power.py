@@ -0,0 +1,146 @@
+import argparse
+import configparser
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import config_manager
+import log_manager
+
+logger = logging.getLogger(__name__)
+
+# An idle service should only wake up for the hotkey, the tray or a signal
+MAX_IDLE_WAKEUPS_PER_SEC = 1.0
+SETTLE_SEC = 2.0  # Lets start-up work (logging, history writer) finish first
+
+
+def read_threads(pid):
+    """Returns {tid: (name, cpu seconds, wakeups)} for the threads of pid.
+
+    Wakeups are counted as voluntary context switches: every time a thread
+    blocks, something has to wake it up again.
+    """
+    ticks = os.sysconf("SC_CLK_TCK")
+    threads = {}
+    for task in Path(f"/proc/{pid}/task").iterdir():
+        try:
+            stat = (task / "stat").read_text()
+            status = (task / "status").read_text()
+        except (FileNotFoundError, ProcessLookupError):
+            continue  # The thread exited
+        name = stat[stat.index("(") + 1 : stat.rindex(")")]
+        fields = stat[stat.rindex(")") + 2 :].split()
+        cpu = (int(fields[11]) + int(fields[12])) / ticks  # utime + stime
+        wakeups = next(
+            int(line.split()[1])
+            for line in status.splitlines()
+            if line.startswith("voluntary_ctxt_switches")
+        )
+        threads[int(task.name)] = (name, cpu, wakeups)
+    return threads
+
+
+def measure(pid, seconds):
+    """Measures CPU use and wakeups of a process over `seconds` seconds."""
+    before = read_threads(pid)
+    time.sleep(seconds)
+    after = read_threads(pid)
+    if pid == os.getpid():  # Python thread names are more telling
+        names = {thread.native_id: thread.name for thread in threading.enumerate()}
+    else:
+        names = {}
+    per_thread = []
+    for tid, (name, cpu, wakeups) in after.items():
+        _, cpu_before, wakeups_before = before.get(tid, (name, 0.0, 0))
+        name = names.get(tid, name)
+        per_thread.append(
+            (name, tid, cpu - cpu_before, (wakeups - wakeups_before) / seconds)
+        )
+    per_thread.sort(key=lambda thread: thread[3], reverse=True)
+    return {
+        "cpu_seconds_per_hour": sum(thread[2] for thread in per_thread)
+        / seconds
+        * 3600,
+        "wakeups_per_sec": sum(thread[3] for thread in per_thread),
+        "threads": per_thread,
+    }
+
+
+def print_result(result):
+    print(
+        f"Idle CPU: {result['cpu_seconds_per_hour']:.2f} CPU-seconds per hour, "
+        f"{result['wakeups_per_sec']:.2f} wakeups per second"
+    )
+    for name, tid, cpu, wakeups in result["threads"]:
+        if wakeups > 0 or cpu > 0:
+            print(f"  {name:<16} tid {tid:<8} {wakeups:6.2f}/s  {cpu:.3f} CPU-s")
+
+
+def check_service(seconds, max_wakeups):
+    """Starts an idle DictationService in this process and measures it.
+
+    The service runs with main.py's tray status thread, as in the app, on
+    the default settings: the user's config and transcript history are not
+    touched (history is off and its database goes to a temporary directory).
+    Returns True if it stayed below max_wakeups wakeups per second.
+    """
+    import main as app  # Tray status thread; needs a display for pystray
+    from dictation_service import DictationService
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        config = configparser.ConfigParser()
+        config.read_dict(config_manager.DEFAULT_CONFIG)
+        config.set("Advanced", "save_history", "false")
+        config.set("Advanced", "history_db", str(Path(data_dir) / "history.db"))
+        service = DictationService(config)
+        service.status_queue = app.status_queue
+        status_thread = threading.Thread(
+            target=app.status_worker, name="status", daemon=True
+        )
+        status_thread.start()
+        service.start()
+        try:
+            time.sleep(SETTLE_SEC)
+            result = measure(os.getpid(), seconds)
+        finally:
+            service.stop()
+            app.status_queue.put(None)  # Stop the status thread
+            status_thread.join(timeout=SETTLE_SEC)
+    print_result(result)
+    # The measuring thread itself wakes up once, after its sleep
+    wakeups = result["wakeups_per_sec"] - 1 / seconds
+    if wakeups > max_wakeups:
+        print(f"FAIL: {wakeups:.2f} wakeups per second (limit {max_wakeups})")
+        return False
+    print(f"OK: below {max_wakeups} wakeups per second")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure CPU use and wakeups of the idle dictation service."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    measure_parser = commands.add_parser("measure", help="Measure a running process")
+    measure_parser.add_argument("pid", type=int, help="e.g. $(pgrep -f main.py)")
+    measure_parser.add_argument("--seconds", type=float, default=60.0)
+    check = commands.add_parser(
+        "check", help="Start an idle service and fail if it wakes up too often"
+    )
+    check.add_argument("--seconds", type=float, default=30.0)
+    check.add_argument("--max-wakeups", type=float, default=MAX_IDLE_WAKEUPS_PER_SEC)
+    args = parser.parse_args()
+    log_manager.setup_logging("WARNING")
+
+    if args.command == "measure":
+        print_result(measure(args.pid, args.seconds))
+    elif not check_service(args.seconds, args.max_wakeups):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
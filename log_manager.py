@@ -0,0 +1,138 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+from pathlib import Path
+
+LOG_QUEUE_SIZE = 10000  # Records waiting for the writer before new ones are dropped
+LOG_FORMAT = "%(asctime)s %(levelname)-7s [%(threadName)s] %(name)s: %(message)s"
+
+# LogRecord attributes that are not user fields passed via extra=
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_handler = None
+_listener = None
+
+
+class StructuredFormatter(logging.Formatter):
+    """Appends fields passed via extra= as key=value pairs.
+
+    logger.info("Decoded chunk", extra={"audio_sec": 1.0}) is written as
+    '... Decoded chunk audio_sec=1.0', which stays greppable and easy to parse.
+    """
+
+    def format(self, record):
+        line = super().format(record)
+        fields = [
+            f"{key}={value!r}" if isinstance(value, str) else f"{key}={value}"
+            for key, value in vars(record).items()
+            if key not in _RECORD_ATTRS and not key.startswith("_")
+        ]
+        return f"{line} {' '.join(fields)}" if fields else line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread without ever blocking the caller.
+
+    When the queue is full (a stalled stdout or journald), the record is
+    dropped and counted instead of stalling the audio or decode thread.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1  # Handler.handle holds self.lock here
+
+
+class _ReportingListener(logging.handlers.QueueListener):
+    """Writes a warning into the log whenever records were dropped."""
+
+    def __init__(self, handler, *writers):
+        super().__init__(handler.queue, *writers, respect_handler_level=True)
+        self.source = handler
+        self.reported = 0
+
+    def handle(self, record):
+        dropped = self.source.dropped
+        if dropped > self.reported:
+            super().handle(
+                logging.makeLogRecord(
+                    {
+                        "name": __name__,
+                        "levelno": logging.WARNING,
+                        "levelname": "WARNING",
+                        "msg": "Log writer fell behind, dropped records",
+                        "dropped": dropped - self.reported,
+                    }
+                )
+            )
+            self.reported = dropped
+        super().handle(record)
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)  # Wait for room; must not be dropped
+
+
+def setup_logging(level="INFO", log_file=None):
+    """Routes all logging through a bounded queue to a background writer.
+
+    Safe to call again; later calls only change the level.
+    """
+    global _handler, _listener
+    root = logging.getLogger()
+    root.setLevel(_parse_level(level))
+    if _listener is not None:
+        return
+    if log_file:
+        path = Path(log_file).expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        writer = logging.FileHandler(path)
+    else:
+        writer = logging.StreamHandler(sys.stderr)
+    writer.setFormatter(StructuredFormatter(LOG_FORMAT))
+
+    _handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    root.addHandler(_handler)
+    _listener = _ReportingListener(_handler, writer)
+    _listener.start()
+    atexit.register(shutdown_logging)  # The writer thread is a daemon
+
+
+def set_level(level):
+    logging.getLogger().setLevel(_parse_level(level))
+
+
+def dropped_records():
+    """Number of records dropped because the writer fell behind."""
+    return _handler.dropped if _handler else 0
+
+
+def shutdown_logging():
+    """Flushes queued records and stops the writer thread."""
+    global _handler, _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    logging.getLogger().removeHandler(_handler)
+    if _handler.dropped > _listener.reported:
+        print(
+            f"{_handler.dropped - _listener.reported} log records were dropped "
+            "because the log writer fell behind.",
+            file=sys.stderr,
+        )
+    for writer in _listener.handlers:
+        writer.close()
+    _handler = _listener = None
+
+
+def _parse_level(level):
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(str(level).strip().upper())
+    return value if isinstance(value, int) else logging.INFO
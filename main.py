@@ -1,3 +1,4 @@
+import logging
 import queue
 import signal
 import sys
@@ -10,11 +11,16 @@ import pystray
 from PIL import Image, ImageDraw  # For creating icon images
 
 import config_manager
+import log_manager
 from dictation_service import DictationService
-from gui import ConfigWindow
+from gui import ConfigWindow, HistoryWindow
+from profiler import SamplingProfiler
+
+logger = logging.getLogger(__name__)
 
 # --- Globals ---
 dictation_service = None
+profiler = None  # SamplingProfiler, toggled by tray menu or SIGUSR1
 tray_icon = None
 status_queue = queue.Queue()
 root = None  # Tk root for GUI window
@@ -61,7 +67,7 @@ def update_tray_status(status, message=""):
         tooltip = f"Linux Dictation: {message or status.capitalize()}"
         # Limit tooltip length if necessary
         tray_icon.title = tooltip[:63]
-    print(f"Status: {status} - {message}")
+    logger.debug("Status: %s - %s", status, message)
 
 
 # --- Tray Icon Callbacks ---
@@ -75,7 +81,7 @@ def on_configure(icon, item):
     """Callback to open the configuration window."""
     global root, config
     if not root:
-        print("Error: Tk root not initialized.")
+        logger.error("Tk root not initialized.")
         return
 
     # Ensure config is up-to-date before opening window
@@ -85,6 +91,9 @@ def on_configure(icon, item):
     def reload_config_callback(new_config):
         global config
         config = new_config  # Update global config reference
+        log_manager.set_level(
+            config_manager.get_setting(config, "Advanced", "log_level")
+        )
         if dictation_service:
             dictation_service.reload_config(new_config)
         # Hotkey might need re-registering if changed
@@ -99,23 +108,48 @@ def on_configure(icon, item):
         ConfigWindow(root, config, reload_config_callback)
         root.withdraw()  # Hide root window again after creating child
     except tk.TclError as e:
-        print(f"Tkinter error opening config: {e}")
+        logger.error("Tkinter error opening config: %s", e)
         if "application has been destroyed" in str(e):
-            print("Attempting to re-initialize Tk...")
+            logger.info("Attempting to re-initialize Tk...")
             setup_tk_root()  # Try re-initializing
             if root:
                 try:
                     ConfigWindow(root, config, reload_config_callback)
                     root.withdraw()
                 except Exception as e2:
-                    print(f"Failed to open config window after re-init: {e2}")
+                    logger.error("Failed to open config window after re-init: %s", e2)
             else:
-                print("Failed to re-initialize Tk.")
+                logger.error("Failed to re-initialize Tk.")
+
+
+def on_search_history(icon, item):
+    """Callback to open the transcript history search window."""
+    if not root:
+        logger.error("Tk root not initialized.")
+        return
+    try:
+        root.deiconify()
+        root.update()
+        HistoryWindow(root, config_manager.load_config())
+        root.withdraw()
+    except tk.TclError as e:
+        logger.error("Tkinter error opening history: %s", e)
+
+
+def on_toggle_profiler(icon=None, item=None):
+    """Callback to start/stop sampling the dictation threads."""
+    if not profiler:
+        return
+    path = profiler.toggle()
+    if path:
+        update_tray_status(current_status, f"Profile saved: {path.name}")
+    else:
+        update_tray_status(current_status, "Profiling...")
 
 
 def on_quit(icon, item):
     """Callback to clean up and exit the application."""
-    print("Quit requested.")
+    logger.info("Quit requested.")
     if tray_icon:
         tray_icon.stop()
     # Cleanup will be handled in main after tray_icon.run() finishes
@@ -124,58 +158,92 @@ def on_quit(icon, item):
 # --- Hotkey Handling ---
 hotkey_listener_thread = None
 stop_hotkey_listener = threading.Event()
-registered_hotkey = None
+registered_hotkey = None  # keyboard hook of hotkey_handler
+
+
+def on_hotkey_press():
+    """Starts loading an unloaded model while the hotkey is still held down."""
+    if dictation_service and not dictation_service.is_dictating:
+        dictation_service.prefetch_model()
+
+
+def hotkey_handler(activation_key):
+    """Keyboard hook for the hotkey: prefetches on press, toggles on release.
+
+    One hook handles both: keyboard tracks hotkeys by their combo string, so
+    two add_hotkey calls on the same combo cannot both be removed again.
+    """
+    steps = keyboard.parse_hotkey(activation_key)
+    if len(steps) != 1:
+        raise ValueError(f"'{activation_key}' has more than one step")
+    combo = steps[0]  # The scan codes each key of the combo may have
+    held = set()
+    pressed = False
+
+    def handle(event):
+        nonlocal pressed
+        if event.event_type == keyboard.KEY_DOWN:
+            held.add(event.scan_code)
+            if not pressed and all(held.intersection(codes) for codes in combo):
+                pressed = True
+                on_hotkey_press()
+        else:
+            held.discard(event.scan_code)
+            # Toggling on release keeps the keys out of the typed text
+            if pressed and any(event.scan_code in codes for codes in combo):
+                pressed = False
+                on_toggle_dictation()
+
+    return handle
 
 
 def hotkey_worker(activation_key):
     """Listens for the global hotkey."""
     global registered_hotkey
     try:
-        print(f"Registering hotkey: {activation_key}")
+        logger.info("Registering hotkey: %s", activation_key)
         # Unregister previous hotkey if any
         if registered_hotkey:
             try:
-                keyboard.remove_hotkey(registered_hotkey)
-                print(f"Unregistered previous hotkey.")
+                keyboard.unhook(registered_hotkey)
+                logger.info("Unregistered previous hotkey.")
             except Exception as e:
-                print(f"Warning: Could not unregister previous hotkey: {e}")
+                logger.warning("Could not unregister previous hotkey: %s", e)
             registered_hotkey = None
 
-        # Use keyboard.add_hotkey
-        # The trigger_on_release=True helps prevent accidental double-triggering
-        # and ensures the hotkey isn't active while keys are held for typing.
-        registered_hotkey = keyboard.add_hotkey(
-            activation_key, on_toggle_dictation, trigger_on_release=True
-        )
-        print(f"Hotkey '{activation_key}' registered successfully.")
+        # Toggles on release; on press, an evicted model starts reloading
+        # while the keys are still held
+        registered_hotkey = keyboard.hook(hotkey_handler(activation_key))
+        logger.info("Hotkey '%s' registered successfully.", activation_key)
         update_tray_status(current_status, f"Ready (Hotkey: {activation_key})")
 
         # Keep the thread alive while listening - keyboard library handles this internally
         # Wait for the stop event
         stop_hotkey_listener.wait()
-        print("Hotkey listener stopping.")
+        logger.info("Hotkey listener stopping.")
 
     except (ImportError, OSError, ValueError) as e:
-        print(f"\n*** Error setting up global hotkey '{activation_key}' ***")
-        print(f"    Error: {e}")
-        print(f"    The 'keyboard' library might require root privileges")
-        print(
-            f"    or your user to be in the 'input' group on Linux (especially Wayland)."
+        logger.error(
+            "Error setting up global hotkey '%s': %s\n"
+            "    The 'keyboard' library might require root privileges\n"
+            "    or your user to be in the 'input' group (especially on Wayland).\n"
+            "    Try running with 'sudo python main.py' OR\n"
+            "    'sudo usermod -a -G input $USER' (logout/login required).",
+            activation_key,
+            e,
         )
-        print(f"    Try running with 'sudo python main.py' OR")
-        print(f"    'sudo usermod -a -G input $USER' (logout/login required).")
         update_tray_status("error", f"Hotkey failed: {e}")
     except Exception as e:
-        print(f"Unexpected error in hotkey listener: {e}")
+        logger.error("Unexpected error in hotkey listener: %s", e)
         update_tray_status("error", f"Hotkey unexpected error: {e}")
     finally:
         # Cleanup hotkey registration when thread stops
         if registered_hotkey:
             try:
-                keyboard.remove_hotkey(registered_hotkey)
-                print("Hotkey unregistered on exit.")
+                keyboard.unhook(registered_hotkey)
+                logger.info("Hotkey unregistered on exit.")
             except Exception as e:
-                print(f"Warning: Could not unregister hotkey on exit: {e}")
+                logger.warning("Could not unregister hotkey on exit: %s", e)
 
 
 def setup_hotkey(config):
@@ -185,17 +253,17 @@ def setup_hotkey(config):
     activation_key = config_manager.get_setting(config, "General", "activation_hotkey")
 
     if hotkey_listener_thread and hotkey_listener_thread.is_alive():
-        print("Stopping existing hotkey listener...")
+        logger.info("Stopping existing hotkey listener...")
         stop_hotkey_listener.set()
         hotkey_listener_thread.join(timeout=1.0)
         if hotkey_listener_thread.is_alive():
-            print("Warning: Hotkey listener thread did not stop gracefully.")
-        # Clear previous registration just in case remove_hotkey in worker failed
+            logger.warning("Hotkey listener thread did not stop gracefully.")
+        # Clear previous registration just in case unhook in worker failed
         if registered_hotkey:
             try:
-                keyboard.remove_hotkey(registered_hotkey)
-            except:
-                pass
+                keyboard.unhook(registered_hotkey)
+            except (KeyError, ValueError) as e:  # Already removed by the worker
+                logger.warning("Could not unregister stale hotkey: %s", e)
             registered_hotkey = None
 
     stop_hotkey_listener.clear()
@@ -208,24 +276,21 @@ def setup_hotkey(config):
 
 
 # --- Status Queue Processing ---
-def process_status_queue():
-    """Checks the status queue and updates the UI."""
-    while not status_queue.empty():
-        try:
-            status, message = status_queue.get_nowait()
-            update_tray_status(status, message)
-        except queue.Empty:
+def status_worker():
+    """Updates the tray icon as status messages arrive.
+
+    Blocks on the queue instead of polling it, so an idle app never wakes up
+    until the hotkey, the tray menu or a signal does something. A None item
+    stops the thread.
+    """
+    while True:
+        item = status_queue.get()
+        if item is None:
             break
+        try:
+            update_tray_status(*item)
         except Exception as e:
-            print(f"Error processing status queue: {e}")
-
-    # Schedule next check if tray icon is running
-    if (
-        tray_icon and tray_icon.HAS_NOTIFICATION
-    ):  # Check if tray backend supports notifications/updates
-        # Schedule using Tkinter's after() method since tray runs in main thread with it
-        if root:
-            root.after(200, process_status_queue)  # Check every 200ms
+            logger.error("Error processing status queue: %s", e)
 
 
 # --- Main Application Logic ---
@@ -240,29 +305,34 @@ def setup_tk_root():
     try:
         root = tk.Tk()
         root.withdraw()  # Hide the main window
-        print("Tk root initialized.")
+        logger.info("Tk root initialized.")
     except Exception as e:
-        print(f"Failed to initialize Tkinter: {e}")
+        logger.error("Failed to initialize Tkinter: %s", e)
         root = None
 
 
 def main():
-    global dictation_service, tray_icon, config, root
+    global dictation_service, tray_icon, config, root, profiler
 
-    print("Starting Linux Dictation...")
+    # Load configuration
+    config = config_manager.load_config()
+    log_manager.setup_logging(
+        config_manager.get_setting(config, "Advanced", "log_level"),
+        config_manager.get_setting(config, "Advanced", "log_file"),
+    )
+    logger.info("Starting Linux Dictation...")
 
     # Handle termination signals gracefully
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
-
-    # Load configuration
-    config = config_manager.load_config()
+    # kill -USR1 <pid> toggles the sampling profiler
+    signal.signal(signal.SIGUSR1, profiler_signal_handler)
 
     # Initialize hidden Tk root for GUI dialogs
     setup_tk_root()
     if not root:
-        print(
-            "Error: Could not initialize Tkinter. Configuration window will not work."
+        logger.warning(
+            "Could not initialize Tkinter. Configuration window will not work."
         )
         # Optionally exit or continue without GUI config
 
@@ -274,6 +344,7 @@ def main():
     # Pass its queue for status updates
     dictation_service.status_queue = status_queue
     dictation_service.start()  # Start background threads (like text insertion)
+    profiler = SamplingProfiler(dictation_service)
 
     # Setup Hotkey Listener
     setup_hotkey(config)
@@ -284,7 +355,9 @@ def main():
             "Toggle Dictation", on_toggle_dictation, default=True, visible=False
         ),  # Double-click action
         pystray.MenuItem("Toggle Dictation", on_toggle_dictation),
+        pystray.MenuItem("Search History", on_search_history),
         pystray.MenuItem("Configure", on_configure),
+        pystray.MenuItem("Toggle Profiler", on_toggle_profiler),
         pystray.MenuItem("Quit", on_quit),
     )
 
@@ -304,56 +377,63 @@ def main():
             "linux_dictation", status_icons[initial_status], "Linux Dictation", menu
         )
 
-        # Start status queue processing loop via Tkinter's mainloop
-        if root:
-            root.after(100, process_status_queue)  # Start checking queue
+        # Apply status updates from the service as they arrive
+        threading.Thread(target=status_worker, name="status", daemon=True).start()
 
-        print("Running tray icon. Use hotkey or tray menu.")
+        logger.info("Running tray icon. Use hotkey or tray menu.")
         # pystray's run() method blocks until stop() is called
         # It often integrates with underlying GUI toolkits (like Tkinter if available)
         tray_icon.run()
 
     except Exception as e:
-        print(f"Error running tray icon: {e}")
-        print(
-            "Check if required packages for pystray backends are installed (e.g., python3-gi, python3-tk)."
+        logger.error(
+            "Error running tray icon: %s. Check if required packages for pystray "
+            "backends are installed (e.g., python3-gi, python3-tk).",
+            e,
         )
 
     finally:
         # --- Cleanup ---
-        print("Cleaning up...")
+        logger.info("Cleaning up...")
 
         # Stop hotkey listener thread
         if hotkey_listener_thread and hotkey_listener_thread.is_alive():
-            print("Stopping hotkey listener...")
+            logger.info("Stopping hotkey listener...")
             stop_hotkey_listener.set()
             hotkey_listener_thread.join(timeout=1.0)
 
         # Stop dictation service
         if dictation_service:
-            print("Stopping dictation service...")
+            logger.info("Stopping dictation service...")
             dictation_service.stop()
+        status_queue.put(None)  # Stop the status thread
 
         # Destroy Tkinter root window if it exists
         if root:
             try:
                 root.quit()  # Exit Tkinter mainloop if somehow still running
                 root.destroy()
-                print("Tk root destroyed.")
+                logger.info("Tk root destroyed.")
             except tk.TclError:
                 pass  # Already destroyed
 
-        print("Linux Dictation finished.")
+        logger.info("Linux Dictation finished.")
+        log_manager.shutdown_logging()
         sys.exit(0)
 
 
 def signal_handler(sig, frame):
     """Handle Ctrl+C or termination signals."""
-    print(f"Signal {sig} received, initiating shutdown...")
+    logger.info("Signal %s received, initiating shutdown...", sig)
     if tray_icon:
         tray_icon.stop()
     # The rest of the cleanup happens in the finally block of main()
 
 
+def profiler_signal_handler(sig, frame):
+    """Toggle the profiler on SIGUSR1 (off the main thread, it joins threads)."""
+    threading.Thread(target=on_toggle_profiler, daemon=True).start()
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,376 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+
+import config_manager
+import log_manager
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "manifest.json"
+
+# Hugging Face checkpoints used when converting a model locally
+SOURCE_MODELS = {
+    "tiny": "openai/whisper-tiny",
+    "tiny.en": "openai/whisper-tiny.en",
+    "base": "openai/whisper-base",
+    "base.en": "openai/whisper-base.en",
+    "small": "openai/whisper-small",
+    "small.en": "openai/whisper-small.en",
+    "medium": "openai/whisper-medium",
+    "medium.en": "openai/whisper-medium.en",
+    "large-v1": "openai/whisper-large",
+    "large-v2": "openai/whisper-large-v2",
+    "large-v3": "openai/whisper-large-v3",
+    "distil-large-v2": "distil-whisper/distil-large-v2",
+}
+
+
+def default_model_dir():
+    """Gets the default directory of the model store."""
+    return (
+        Path(os.environ.get("XDG_DATA_HOME", Path.home() / ".local" / "share"))
+        / "linux-dictation"
+        / "models"
+    )
+
+
+def get_model_dir(config):
+    """Returns the configured model store directory (blank = default)."""
+    configured = config_manager.get_setting(config, "Advanced", "model_dir")
+    return Path(configured).expanduser() if configured else default_model_dir()
+
+
+def cpu_flags():
+    """Returns the CPU feature flags reported by /proc/cpuinfo."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def describe_cpu(flags=None):
+    """Names the best SIMD extension available for CTranslate2 kernels."""
+    flags = cpu_flags() if flags is None else flags
+    if "avx512_vnni" in flags or "avx_vnni" in flags:
+        return "AVX-512/AVX VNNI"
+    if "avx512f" in flags:
+        return "AVX-512"
+    if "avx2" in flags:
+        return "AVX2"
+    return "no AVX2"
+
+
+def recommended_compute_type(device="cpu", flags=None):
+    """Picks the quantization best suited to this machine.
+
+    int8 kernels only pay off with AVX2 or better (VNNI adds dedicated int8 dot
+    products); older CPUs are faster with float32.
+    """
+    if device == "cuda":
+        return "float16"
+    flags = cpu_flags() if flags is None else flags
+    if flags & {"avx2", "avx512f", "avx512_vnni", "avx_vnni"}:
+        return "int8"
+    return "float32"
+
+
+def entry_name(model_size, quantization):
+    return f"{model_size}-{quantization}"
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_manifest(path):
+    try:
+        with open(Path(path) / MANIFEST_FILENAME) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(path, manifest):
+    tmp_path = Path(path) / (MANIFEST_FILENAME + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, Path(path) / MANIFEST_FILENAME)
+
+
+def list_models(model_dir):
+    """Returns (path, manifest) for every installed model, sorted by name."""
+    model_dir = Path(model_dir)
+    if not model_dir.is_dir():
+        return []
+    entries = []
+    for path in sorted(model_dir.iterdir()):
+        manifest = _read_manifest(path) if path.is_dir() else None
+        if manifest:
+            entries.append((path, manifest))
+    return entries
+
+
+def installed_models(model_dir):
+    """Returns the names of installed models (without quantization)."""
+    return sorted({manifest["model"] for _, manifest in list_models(model_dir)})
+
+
+def _hf_cache_dir():
+    if os.environ.get("HF_HUB_CACHE"):
+        return Path(os.environ["HF_HUB_CACHE"])
+    hf_home = os.environ.get("HF_HOME", Path.home() / ".cache" / "huggingface")
+    return Path(hf_home) / "hub"
+
+
+def cached_models():
+    """Returns models faster-whisper already downloaded to the Hugging Face cache."""
+    models = set()
+    cache_dir = _hf_cache_dir()
+    if not cache_dir.is_dir():
+        return models
+    for path in cache_dir.glob("models--Systran--faster-*whisper-*"):
+        if not any((path / "snapshots").glob("*/model.bin")):
+            continue  # Interrupted download
+        repo = path.name.split("--")[-1]
+        if repo.startswith("faster-distil-whisper-"):
+            models.add("distil-" + repo[len("faster-distil-whisper-") :])
+        else:
+            models.add(repo[len("faster-whisper-") :])
+    return models
+
+
+def available_models(model_dir, offline=False):
+    """Models that can be loaded without downloading anything."""
+    models = set(installed_models(model_dir))
+    if not offline:
+        models |= cached_models()
+    return sorted(models)
+
+
+def verify_model(path, full=True):
+    """Checks an installed model against its manifest.
+
+    Sizes are always compared; full=True also recomputes the SHA-256 of every
+    file. Returns a list of problems (empty when the model is intact).
+    """
+    manifest = _read_manifest(path)
+    if manifest is None:
+        return ["missing or unreadable manifest"]
+    problems = []
+    for name, expected in manifest["files"].items():
+        file_path = Path(path) / name
+        if not file_path.is_file():
+            problems.append(f"{name}: missing")
+        elif file_path.stat().st_size != expected["size"]:
+            problems.append(f"{name}: size mismatch")
+        elif full and _sha256(file_path) != expected["sha256"]:
+            problems.append(f"{name}: checksum mismatch")
+    return problems
+
+
+def find_model(model_dir, model_size, quantization):
+    """Returns the path of an intact installed model, preferring the quantization."""
+    candidates = [
+        (path, manifest)
+        for path, manifest in list_models(model_dir)
+        if manifest["model"] == model_size
+    ]
+    candidates.sort(key=lambda entry: entry[1]["quantization"] != quantization)
+    for path, _ in candidates:
+        problems = verify_model(path, full=False)
+        if not problems:
+            return path
+        logger.warning("Ignoring damaged model %s: %s", path.name, ", ".join(problems))
+    return None
+
+
+def load_model(model_dir, model_size, compute_type, factory=None, **options):
+    """Loads model_size from the store if it is installed there.
+
+    Otherwise the name is passed on, so faster-whisper uses its cache or
+    downloads the model. factory defaults to faster_whisper.WhisperModel;
+    options (device, cpu_threads, ...) are passed to it.
+    """
+    if factory is None:
+        from faster_whisper import WhisperModel as factory
+
+    stored = find_model(model_dir, model_size, compute_type)
+    if stored:
+        options["local_files_only"] = True
+    return factory(
+        str(stored) if stored else model_size, compute_type=compute_type, **options
+    )
+
+
+def record_load_time(path, device, compute_type, seconds):
+    """Stores the last measured load time of an installed model."""
+    manifest = _read_manifest(path)
+    if manifest is None:
+        return
+    manifest.setdefault("load_seconds", {})[f"{device}/{compute_type}"] = round(
+        seconds, 3
+    )
+    try:
+        _write_manifest(path, manifest)
+    except OSError as e:
+        logger.warning("Could not record load time for %s: %s", path, e)
+
+
+def install_model(model_dir, model_size, quantization="auto"):
+    """Converts (or downloads) a model into the store and returns its path.
+
+    With `transformers` installed, the original checkpoint is converted with
+    CTranslate2 and the weights are stored already quantized. Otherwise the
+    pre-converted faster-whisper model is downloaded and quantized at load time.
+    """
+    if quantization == "auto":
+        quantization = recommended_compute_type()
+    model_dir = Path(model_dir)
+    model_dir.mkdir(parents=True, exist_ok=True)
+    target = model_dir / entry_name(model_size, quantization)
+    partial = model_dir / (target.name + ".partial")
+    shutil.rmtree(partial, ignore_errors=True)
+
+    try:
+        import transformers  # noqa: F401  # Required by TransformersConverter
+        from ctranslate2.converters import TransformersConverter
+
+        source = SOURCE_MODELS[model_size]
+    except (ImportError, KeyError):
+        from faster_whisper.utils import download_model
+
+        logger.info(
+            "Downloading pre-converted %s (quantized at load time)...", model_size
+        )
+        download_model(model_size, output_dir=str(partial))
+        source = f"faster-whisper/{model_size}"
+        stored_weights = "float16"
+    else:
+        logger.info("Converting %s to %s...", source, quantization)
+        converter = TransformersConverter(
+            source, copy_files=["tokenizer.json", "preprocessor_config.json"]
+        )
+        converter.convert(str(partial), quantization=quantization, force=True)
+        stored_weights = quantization
+
+    files = {}
+    for file_path in sorted(partial.iterdir()):
+        if file_path.is_file():
+            files[file_path.name] = {
+                "size": file_path.stat().st_size,
+                "sha256": _sha256(file_path),
+            }
+    _write_manifest(
+        partial,
+        {
+            "model": model_size,
+            "quantization": quantization,
+            "stored_weights": stored_weights,
+            "source": source,
+            "installed": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "files": files,
+            "load_seconds": {},
+        },
+    )
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(partial, target)
+    logger.info("Installed %s in %s", target.name, model_dir)
+    return target
+
+
+def benchmark_model(path, device="cpu"):
+    """Measures the load time of an installed model and records it."""
+    from faster_whisper import WhisperModel
+
+    compute_type = _read_manifest(path)["quantization"]
+    start_time = time.perf_counter()
+    model = WhisperModel(
+        str(path), device=device, compute_type=compute_type, local_files_only=True
+    )
+    seconds = time.perf_counter() - start_time
+    del model
+    record_load_time(path, device, compute_type, seconds)
+    return seconds
+
+
+def _size_mb(manifest):
+    return sum(f["size"] for f in manifest["files"].values()) / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Manage the local Whisper model store."
+    )
+    parser.add_argument("--model-dir", help="Model store directory (default: config)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List installed models and load times")
+    install = commands.add_parser("install", help="Convert/download a model")
+    install.add_argument("model_size")
+    install.add_argument(
+        "--quantization",
+        default="auto",
+        help="int8, float32, float16, ... (auto = pick from CPU features)",
+    )
+    verify = commands.add_parser("verify", help="Check checksums of installed models")
+    verify.add_argument("names", nargs="*")
+    bench = commands.add_parser("bench", help="Measure cold-start load times")
+    bench.add_argument("names", nargs="*")
+    bench.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+    log_manager.setup_logging()
+
+    model_dir = (
+        Path(args.model_dir)
+        if args.model_dir
+        else get_model_dir(config_manager.load_config())
+    )
+    print(f"Model store: {model_dir}")
+    print(
+        f"CPU: {describe_cpu()} -> recommended compute_type "
+        f"{recommended_compute_type()}"
+    )
+
+    if args.command == "install":
+        install_model(model_dir, args.model_size, args.quantization)
+        return
+
+    entries = list_models(model_dir)
+    if getattr(args, "names", None):
+        entries = [(p, m) for p, m in entries if p.name in args.names]
+
+    if args.command == "list":
+        for path, manifest in entries:
+            load_times = ", ".join(
+                f"{key} {seconds:.2f}s"
+                for key, seconds in sorted(manifest.get("load_seconds", {}).items())
+            )
+            print(
+                f"{path.name:28} {_size_mb(manifest):8.0f} MB  "
+                f"load: {load_times or 'not measured'}"
+            )
+    elif args.command == "verify":
+        for path, _ in entries:
+            problems = verify_model(path)
+            print(f"{path.name}: {'OK' if not problems else '; '.join(problems)}")
+    elif args.command == "bench":
+        for path, _ in entries:
+            seconds = benchmark_model(path, args.device)
+            print(f"{path.name}: loaded in {seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
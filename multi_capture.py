@@ -0,0 +1,440 @@
+import argparse
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+import config_manager
+import log_manager
+import model_store
+from audio_utils import AudioBuffer, is_speech, read_wav
+from dictation_service import (
+    MAX_UTTERANCE_SEC,
+    SILENCE_THRESHOLD,
+    UTTERANCE_PAUSE_SEC,
+    token_budget,
+    transcribe_options,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_COALESCED_SEC = 30.0  # Whisper's input window
+BLOCK_SEC = 0.5
+WARM_UP_SEC = 1.0  # Audio decoded by start() to measure the model
+# Decode seconds per audio second assumed if the warm-up decode fails
+DEFAULT_SECONDS_PER_AUDIO_SECOND = 1.0
+
+
+class DecodeScheduler:
+    """Runs decodes of several capture streams on one shared WhisperModel.
+
+    Each stream has its own FIFO queue and a latency budget. The next decode
+    is taken from the stream whose oldest request has the earliest deadline
+    (EDF). Queued utterances of that stream are decoded together, so a stream
+    that fell behind catches up in one decode instead of queueing more. Only
+    as many are merged as are predicted to finish before the earliest
+    deadline of the other streams, so a busy stream can't crowd them out.
+    When the predicted finish time would miss the deadline, the decode falls
+    back to greedy search (beam_size=1). Like dictation, every decode gets a token budget for its
+    length, so a stream that hallucinates on noise can't hold the model long.
+    """
+
+    def __init__(self, model, sample_rate, options, max_tokens_per_second=0.0):
+        self.model = model
+        self.sample_rate = sample_rate
+        self.transcribe_options = options
+        self.max_tokens_per_second = max_tokens_per_second
+        self.condition = threading.Condition()
+        self.pending = {}  # stream name -> list of (audio, submitted, deadline, sink)
+        self.stats = {}  # stream name -> dict of latencies/misses/decodes
+        # Running estimate of full-beam decode time per audio second, seeded
+        # by the warm-up decode in start()
+        self.seconds_per_audio_second = DEFAULT_SECONDS_PER_AUDIO_SECOND
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self.running = False
+        self.worker_thread = None
+
+    def start(self):
+        self._warm_up()
+        self.running = True
+        self.started_at = time.perf_counter()
+        self.worker_thread = threading.Thread(target=self._worker, daemon=True)
+        self.worker_thread.start()
+
+    def stop(self):
+        """Finishes queued decodes and stops the worker."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.worker_thread:
+            self.worker_thread.join()
+
+    def submit(self, stream, audio, budget, sink):
+        """Queues an utterance; sink(text) is called when it is decoded."""
+        now = time.perf_counter()
+        with self.condition:
+            self.pending.setdefault(stream, []).append((audio, now, now + budget, sink))
+            self.stats.setdefault(
+                stream, {"latencies": [], "misses": 0, "decodes": 0, "greedy": 0}
+            )
+            self.condition.notify()
+
+    def _warm_up(self):
+        """Measures a first decode, so the first scheduled ones are predicted."""
+        options = dict(self.transcribe_options, vad_filter=False)  # Decode it all
+        start_time = time.perf_counter()
+        try:
+            segments, _ = self.model.transcribe(
+                np.zeros(int(WARM_UP_SEC * self.sample_rate), dtype=np.float32),
+                **options,
+            )
+            list(segments)
+        except Exception as e:
+            logger.warning("Warm-up decode failed, assuming real time: %s", e)
+            return
+        self.seconds_per_audio_second = (time.perf_counter() - start_time) / WARM_UP_SEC
+
+    def _take_next(self):
+        """Removes and returns the queued work of the most urgent stream."""
+        heads = {
+            name: requests[0] for name, requests in self.pending.items() if requests
+        }
+        stream = min(heads, key=lambda name: heads[name][2])
+        # Merge only what is predicted to finish before another stream's deadline
+        other_deadline = min(
+            (head[2] for name, head in heads.items() if name != stream),
+            default=None,
+        )
+        max_samples = MAX_COALESCED_SEC * self.sample_rate
+        if other_deadline is not None:
+            slack = other_deadline - time.perf_counter()
+            max_samples = min(
+                max_samples,
+                slack / self.seconds_per_audio_second * self.sample_rate,
+            )
+        requests = self.pending[stream]
+        batch = [requests.pop(0)]
+        batch_samples = len(batch[0][0])
+        while requests and batch_samples + len(requests[0][0]) <= max_samples:
+            batch_samples += len(requests[0][0])
+            batch.append(requests.pop(0))
+        return stream, batch
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while self.running and not any(self.pending.values()):
+                    self.condition.wait()
+                if not any(self.pending.values()):
+                    return  # Stopped and drained
+                stream, batch = self._take_next()
+
+            audio = AudioBuffer()
+            for request in batch:
+                audio.extend(request[0])
+            deadline = batch[0][2]
+            audio_seconds = len(audio) / self.sample_rate
+            options = dict(self.transcribe_options)
+            options["max_new_tokens"] = token_budget(
+                audio_seconds, self.max_tokens_per_second
+            )
+            predicted_end = (
+                time.perf_counter() + audio_seconds * self.seconds_per_audio_second
+            )
+            greedy = predicted_end > deadline and options.get("beam_size", 1) > 1
+            if greedy:
+                options["beam_size"] = 1
+
+            start_time = time.perf_counter()
+            try:
+                segments, _ = self.model.transcribe(audio.to_float32(), **options)
+                text = "".join(segment.text for segment in segments).strip()
+            except Exception as e:
+                logger.error("Error decoding stream %s: %s", stream, e)
+                text = ""
+            finished = time.perf_counter()
+            decode_seconds = finished - start_time
+            self.busy_seconds += decode_seconds
+            if not greedy:
+                # Exponential moving average of decode time per audio second
+                measured = decode_seconds / max(audio_seconds, 0.1)
+                self.seconds_per_audio_second = (
+                    0.8 * self.seconds_per_audio_second + 0.2 * measured
+                )
+
+            stats = self.stats[stream]
+            stats["decodes"] += 1
+            stats["greedy"] += int(greedy)
+            for _, submitted, request_deadline, _ in batch:
+                stats["latencies"].append(finished - submitted)
+                stats["misses"] += int(finished > request_deadline)
+            if text:
+                try:
+                    batch[-1][3](text)
+                except Exception as e:
+                    logger.error("Error writing output of stream %s: %s", stream, e)
+
+    def report(self):
+        """Returns per-stream latency lines and the model utilisation."""
+        lines = []
+        for stream, stats in sorted(self.stats.items()):
+            latencies = sorted(stats["latencies"])
+            if not latencies:
+                continue
+            lines.append(
+                f"{stream}: {len(latencies)} utterances, {stats['decodes']} decodes "
+                f"({stats['greedy']} greedy), latency p50 "
+                f"{latencies[len(latencies) // 2]:.2f}s p95 "
+                f"{latencies[int(len(latencies) * 0.95)]:.2f}s max "
+                f"{latencies[-1]:.2f}s, {stats['misses']} over budget"
+            )
+        if self.started_at is not None:
+            elapsed = time.perf_counter() - self.started_at
+            lines.append(f"Model utilisation: {self.busy_seconds / elapsed:.0%}")
+        return lines
+
+
+class CapturePipeline:
+    """Endpoints one audio stream into utterances and submits them for decoding."""
+
+    def __init__(
+        self,
+        name,
+        scheduler,
+        sample_rate,
+        budget,
+        sink,
+        speech_threshold=SILENCE_THRESHOLD,
+    ):
+        self.name = name
+        self.scheduler = scheduler
+        self.sample_rate = sample_rate
+        self.budget = budget
+        self.sink = sink
+        self.speech_threshold = speech_threshold
+        self.audio_queue = queue.Queue()
+        self.utterance = AudioBuffer()
+        self.silent_samples = 0
+        self.has_speech = False
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def feed(self, chunk):
+        """Called from the audio source thread for each block."""
+        self.audio_queue.put(chunk)
+
+    def finish(self):
+        """Ends the stream; the remaining audio is submitted."""
+        self.audio_queue.put(None)
+        self.thread.join()
+
+    def _worker(self):
+        while True:
+            chunk = self.audio_queue.get()
+            if chunk is None:
+                self._end_utterance()
+                return
+            self.utterance.append(chunk)
+            # Silence is counted in samples, so WAV replays endpoint exactly
+            # like live audio regardless of playback speed
+            if is_speech(chunk, self.speech_threshold):
+                self.has_speech = True
+                self.silent_samples = 0
+            else:
+                self.silent_samples += len(chunk)
+            if (
+                self.has_speech
+                and self.silent_samples >= UTTERANCE_PAUSE_SEC * self.sample_rate
+            ) or len(self.utterance) >= MAX_UTTERANCE_SEC * self.sample_rate:
+                self._end_utterance()
+            elif not self.has_speech and len(self.utterance) >= self.sample_rate:
+                self._reset()  # Drop leading silence
+
+    def _end_utterance(self):
+        if self.has_speech and len(self.utterance):
+            self.scheduler.submit(self.name, self.utterance, self.budget, self.sink)
+        self._reset()
+
+    def _reset(self):
+        self.utterance = AudioBuffer()
+        self.silent_samples = 0
+        self.has_speech = False
+
+
+def play_wav(pipeline, audio, sample_rate, speed):
+    """Feeds a WAV into a pipeline in blocks, paced like a microphone."""
+    block = int(BLOCK_SEC * sample_rate)
+    start_time = time.perf_counter()
+    for index, offset in enumerate(range(0, len(audio), block)):
+        pipeline.feed(audio[offset : offset + block])
+        delay = start_time + (index + 1) * BLOCK_SEC / speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    pipeline.finish()
+
+
+def file_sink(path):
+    """Returns a sink that appends each utterance as a line to path."""
+    lock = threading.Lock()
+
+    def write(text):
+        with lock, open(path, "a") as f:
+            f.write(text + "\n")
+
+    return write
+
+
+def load_model(config):
+    """Loads the configured model once for all streams."""
+    model_size = config.get("General", "model_size")
+    device = config.get("General", "device")
+    compute_type = config.get("General", "compute_type")
+    if compute_type == "auto":
+        compute_type = model_store.recommended_compute_type(device)
+    logger.info("Loading shared model: %s (%s, %s)", model_size, device, compute_type)
+    return model_store.load_model(
+        model_store.get_model_dir(config), model_size, compute_type, device=device
+    )
+
+
+def decode_options(config):
+    """The dictation decode options, without the per-decode token budget."""
+    language = config.get("General", "language")
+    return transcribe_options(
+        None if language == "auto" else language,
+        config.getint("Whisper", "beam_size"),
+        config.getboolean("Whisper", "use_vad_filter"),
+        config.get("Whisper", "initial_prompt") or None,
+        compression_ratio_threshold=config.getfloat(
+            "Whisper", "compression_ratio_threshold", fallback=2.4
+        ),
+        no_speech_threshold=config.getfloat(
+            "Whisper", "no_speech_threshold", fallback=0.6
+        ),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Transcribe several microphones (or WAV files) with one model."
+    )
+    parser.add_argument(
+        "--wav", nargs="+", help="Use WAV files as synthetic streams instead of mics"
+    )
+    parser.add_argument(
+        "--streams", type=int, default=0, help="Cycle the WAV files to N streams"
+    )
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="WAV playback speed (1.0 = real time)"
+    )
+    args = parser.parse_args()
+    log_manager.setup_logging()
+
+    config = config_manager.load_config()
+    sample_rate = config.getint("Advanced", "sample_rate")
+    budget = config_manager.get_setting(config, "MultiMic", "latency_budget", float)
+    output_dir = Path(
+        config_manager.get_setting(config, "MultiMic", "output_dir")
+        or Path.home() / "linux-dictation-transcripts"
+    ).expanduser()
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    speech_threshold = config.getint(
+        "Advanced", "speech_threshold", fallback=SILENCE_THRESHOLD
+    )
+    scheduler = DecodeScheduler(
+        load_model(config),
+        sample_rate,
+        decode_options(config),
+        config.getfloat("Whisper", "max_tokens_per_second", fallback=12.0),
+    )
+    scheduler.start()
+
+    if args.wav:
+        clips = [read_wav(path, sample_rate) for path in args.wav]
+        count = max(args.streams, len(clips))
+        players = []
+        for index in range(count):
+            name = f"wav{index}"
+            pipeline = CapturePipeline(
+                name,
+                scheduler,
+                sample_rate,
+                budget,
+                file_sink(output_dir / f"{name}.txt"),
+                speech_threshold,
+            )
+            pipeline.start()
+            player = threading.Thread(
+                target=play_wav,
+                args=(pipeline, clips[index % len(clips)], sample_rate, args.speed),
+            )
+            player.start()
+            players.append(player)
+        for player in players:
+            player.join()
+    else:
+        import sounddevice as sd
+
+        devices = [
+            device.strip()
+            for device in config_manager.get_setting(
+                config, "MultiMic", "devices"
+            ).split(",")
+            if device.strip()
+        ]
+        if not devices:
+            parser.error("No devices configured in [MultiMic] devices")
+        streams = []
+        for device in devices:
+            device_id = int(device) if device.isdigit() else device
+            name = f"mic-{device}".replace("/", "_").replace(":", "_")
+            pipeline = CapturePipeline(
+                name,
+                scheduler,
+                sample_rate,
+                budget,
+                file_sink(output_dir / f"{name}.txt"),
+                speech_threshold,
+            )
+            pipeline.start()
+
+            def callback(indata, frames, time_info, status, pipeline=pipeline):
+                pipeline.feed(indata[:, 0].copy())
+
+            stream = sd.InputStream(
+                samplerate=sample_rate,
+                blocksize=int(BLOCK_SEC * sample_rate),
+                device=device_id,
+                channels=1,
+                dtype="int16",
+                callback=callback,
+            )
+            stream.start()
+            streams.append((stream, pipeline))
+        print(
+            f"Capturing {len(streams)} microphones into {output_dir}. Ctrl+C to stop."
+        )
+        try:
+            while True:
+                time.sleep(30)
+                print("\n".join(scheduler.report()))
+        except KeyboardInterrupt:
+            pass
+        for stream, pipeline in streams:
+            stream.stop()
+            stream.close()
+            pipeline.finish()
+
+    scheduler.stop()
+    print("\n".join(scheduler.report()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+import errno
+import logging
+import os
+import queue
+import socket
+import stat
+import threading
+import time
+from pathlib import Path
+
+import config_manager
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("drop", "block")
+STOP_TIMEOUT_SEC = 2.0
+
+
+class OutputSink:
+    """Delivers transcript events from its own bounded queue and thread.
+
+    Events are (kind, utterance_id, text) tuples: kind "text" for final text
+    typed segment by segment, "transcript" for the whole text of a decode
+    once it is done, or "partial"/"final" for typed partial results. A sink
+    gets only the kinds it lists in kinds. Each sink has a policy for when
+    its queue is full: "drop" discards the event (and counts it), "block"
+    makes the caller wait for room. Either way a slow consumer only delays
+    other sinks once it is queue_size events behind.
+    """
+
+    kinds = ("text", "final")  # Event kinds delivered to this sink
+
+    def __init__(self, name, queue_size, policy):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy '{policy}' (use drop or block)")
+        self.name = name
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.lock = threading.Lock()  # Counters updated by submitting threads
+        self.delivered = 0
+        self.dropped = 0
+        self.failed = 0
+        self.peak_backlog = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self._worker, name=f"sink-{self.name}", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, kind, utterance_id, text):
+        """Queues an event without waiting for the consumer (see policy)."""
+        if kind not in self.kinds:
+            return
+        item = (time.perf_counter(), (kind, utterance_id, text))
+        if self.policy == "block":
+            self.queue.put(item)
+        else:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self._count_drop()
+                return
+        with self.lock:
+            self.peak_backlog = max(self.peak_backlog, self.queue.qsize())
+
+    def clear(self):
+        """Discards events not delivered yet."""
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def stop(self):
+        """Delivers the queued events (within STOP_TIMEOUT_SEC) and closes."""
+        if self.thread and self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=STOP_TIMEOUT_SEC)
+                self.thread.join(timeout=STOP_TIMEOUT_SEC)
+            except queue.Full:
+                logger.warning("Output %s is stuck, not waiting for it.", self.name)
+        self.thread = None
+        self.close()
+
+    def report(self):
+        """One line of delivery, backlog and latency metrics."""
+        average = self.latency_total / self.delivered if self.delivered else 0.0
+        return (
+            f"Output {self.name} ({self.policy}): {self.delivered} delivered, "
+            f"{self.dropped} dropped, {self.failed} failed, backlog "
+            f"{self.queue.qsize()} (peak {self.peak_backlog}), latency "
+            f"{average * 1000:.0f} ms avg, {self.latency_max * 1000:.0f} ms max"
+        )
+
+    def write(self, kind, utterance_id, text):
+        """Delivers one event. May return False if it dropped the event."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def _count_drop(self):
+        with self.lock:
+            self.dropped += 1
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            submitted, event = item
+            try:
+                if self.write(*event) is False:
+                    continue  # Dropped by the sink itself, already counted
+            except Exception as e:
+                self.failed += 1
+                logger.error("Error writing to output %s: %s", self.name, e)
+                continue
+            latency = time.perf_counter() - submitted
+            self.delivered += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+
+class CallbackSink(OutputSink):
+    """Passes typed text and partials to a function (e.g. typing)."""
+
+    kinds = ("text", "partial", "final")
+
+    def __init__(self, name, callback, queue_size, policy):
+        super().__init__(name, queue_size, policy)
+        self.callback = callback
+
+    def write(self, kind, utterance_id, text):
+        self.callback(kind, utterance_id, text)
+
+
+class LineSink(OutputSink):
+    """Base for sinks that get one line of final text per transcript.
+
+    Streamed segments are skipped: each decode arrives whole, as a
+    "transcript" (or, with typed partials, the "final" of its utterance).
+    """
+
+    kinds = ("transcript", "final")
+
+    def write(self, kind, utterance_id, text):
+        if text.strip():
+            return self.write_line(text.strip() + "\n")
+
+    def write_line(self, line):
+        raise NotImplementedError
+
+
+class FileSink(LineSink):
+    """Appends transcripts to a text file."""
+
+    def __init__(self, path, queue_size, policy):
+        super().__init__("file", queue_size, policy)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, "a", buffering=1)  # Line buffered
+
+    def write_line(self, line):
+        self.file.write(line)
+
+    def close(self):
+        self.file.close()
+
+
+class NamedPipeSink(LineSink):
+    """Writes transcripts to a FIFO (created if missing) while a reader has it open.
+
+    Text dictated while no process reads the pipe is dropped.
+    """
+
+    def __init__(self, path, queue_size, policy):
+        super().__init__("named_pipe", queue_size, policy)
+        if not path.exists():
+            os.mkfifo(path)
+        elif not stat.S_ISFIFO(path.stat().st_mode):
+            raise ValueError(f"{path} exists and is not a named pipe")
+        self.path = path
+        self.fd = None
+
+    def write_line(self, line):
+        if self.fd is None:
+            try:
+                # Non-blocking open fails instead of waiting for a reader
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                self._count_drop()  # No reader
+                return False
+            os.set_blocking(self.fd, True)  # A slow reader only holds up this sink
+        data = line.encode()
+        try:
+            while data:
+                data = data[os.write(self.fd, data) :]
+        except BrokenPipeError:
+            self._count_drop()  # The reader went away
+            self.close()
+            return False
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class UnixSocketSink(LineSink):
+    """Sends transcripts to every client connected to a Unix socket.
+
+    Clients are accepted when the next transcript is sent, e.g. with
+    `socat - UNIX-CONNECT:<path>` or `nc -U <path>`. Text sent while no
+    client is connected is dropped.
+    """
+
+    def __init__(self, path, queue_size, policy):
+        super().__init__("unix_socket", queue_size, policy)
+        if path.exists() and stat.S_ISSOCK(path.stat().st_mode):
+            path.unlink()  # Left over from an earlier run
+        self.path = path
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(str(path))
+        self.server.listen()
+        self.server.setblocking(False)
+        self.clients = []
+
+    def write_line(self, line):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except BlockingIOError:
+                break
+            client.setblocking(True)
+            self.clients.append(client)
+        if not self.clients:
+            self._count_drop()  # Nobody listening
+            return False
+        data = line.encode()
+        for client in list(self.clients):
+            try:
+                client.sendall(data)
+            except OSError:  # Disconnected
+                client.close()
+                self.clients.remove(client)
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+        self.clients = []
+        self.server.close()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+# [Output] options naming the path of a sink -> sink class
+PATH_SINKS = {
+    "file": FileSink,
+    "named_pipe": NamedPipeSink,
+    "unix_socket": UnixSocketSink,
+}
+
+
+def _policy(config, name):
+    """The [Output] policy of sink `name`, or its default if it is unknown."""
+    key = f"{name}_policy"
+    policy = config_manager.get_setting(config, "Output", key).strip().lower()
+    if policy not in POLICIES:
+        default = config_manager.DEFAULT_CONFIG["Output"][key]
+        logger.error(
+            "Unknown %s '%s' (use drop or block), using %s", key, policy, default
+        )
+        return default
+    return policy
+
+
+def create_sinks(config, type_text):
+    """Builds the sinks enabled in [Output]; type_text handles keyboard events."""
+    queue_size = config_manager.get_setting(config, "Output", "queue_size", int)
+    sinks = []
+    if config.getboolean("Output", "keyboard", fallback=True):
+        policy = _policy(config, "keyboard")
+        sinks.append(CallbackSink("keyboard", type_text, queue_size, policy))
+    for name, sink_class in PATH_SINKS.items():
+        path = config_manager.get_setting(config, "Output", name)
+        if not path:
+            continue
+        policy = _policy(config, name)
+        try:
+            sinks.append(sink_class(Path(path).expanduser(), queue_size, policy))
+        except (OSError, ValueError) as e:
+            logger.error("Could not open %s output %s: %s", name, path, e)
+    return sinks
@@ -0,0 +1,137 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL_SEC = 0.01  # 100 Hz
+# Threads started by DictationService (see the name= arguments there)
+SERVICE_THREAD_NAMES = ("stt-worker", "final-decode", "decode")
+SINK_THREAD_PREFIX = "sink-"  # Output sink threads, e.g. sink-keyboard
+
+
+def default_profile_dir():
+    """Gets the directory profiles are written to."""
+    return (
+        Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+        / "linux-dictation"
+        / "profiles"
+    )
+
+
+def _service_state(service):
+    """Dictation state a sample is tagged with."""
+    if service.model_lock.locked():
+        return "loading-model"
+    if service.is_dictating:
+        return "dictating"
+    if not service.audio_queue.empty() or any(
+        not sink.queue.empty() for sink in service.sinks
+    ):
+        return "finishing"
+    return "idle"
+
+
+def _collapse(frame):
+    """Returns the stack of frame as 'outermost;...;innermost'."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{Path(code.co_filename).name}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Samples the stacks of the dictation threads at a fixed rate.
+
+    Each sample is stored as a collapsed stack prefixed with the thread name
+    and the dictation state, e.g. 'stt-worker;dictating;...;transcribe'. The
+    output can be fed straight into flamegraph.pl or speedscope.
+    """
+
+    def __init__(self, service, out_dir=None, interval=SAMPLE_INTERVAL_SEC):
+        self.service = service
+        self.out_dir = Path(out_dir) if out_dir else default_profile_dir()
+        self.interval = interval
+        self.samples = Counter()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.started_at = None
+        self.sampling_seconds = 0.0
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def toggle(self):
+        """Starts sampling, or stops and writes the profile. Returns its path."""
+        if self.running:
+            return self.stop()
+        self.start()
+        return None
+
+    def start(self):
+        self.samples.clear()
+        self.sampling_seconds = 0.0
+        self.stop_event.clear()
+        self.started_at = time.perf_counter()
+        self.thread = threading.Thread(
+            target=self._sampler, name="profiler", daemon=True
+        )
+        self.thread.start()
+        logger.info("Profiler started (%.0f Hz).", 1 / self.interval)
+
+    def stop(self):
+        """Stops sampling and writes the collapsed stacks file."""
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        elapsed = time.perf_counter() - self.started_at
+
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        path = self.out_dir / time.strftime("profile-%Y%m%d-%H%M%S.folded")
+        with open(path, "w") as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+        logger.info(
+            "Profiler stopped: %s samples in %.1fs, sampling overhead %.2f%% "
+            "of one core. Written to %s",
+            sum(self.samples.values()),
+            elapsed,
+            self.sampling_seconds / elapsed * 100,
+            path,
+        )
+        return path
+
+    def _sampler(self):
+        next_sample = time.perf_counter()
+        while not self.stop_event.is_set():
+            sample_start = time.perf_counter()
+            targets = {
+                thread.ident: thread.name
+                for thread in threading.enumerate()
+                if thread.name in SERVICE_THREAD_NAMES
+                or thread.name.startswith(SINK_THREAD_PREFIX)
+            }
+            if targets:
+                state = _service_state(self.service)
+                frames = sys._current_frames()
+                for ident, name in targets.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self.samples[f"{name};{state};{_collapse(frame)}"] += 1
+                del frames  # Don't keep other threads' frames alive
+            self.sampling_seconds += time.perf_counter() - sample_start
+
+            # Fixed rate: schedule from the ideal time, not from when we woke up
+            next_sample += self.interval
+            delay = next_sample - time.perf_counter()
+            if delay < 0:
+                next_sample = time.perf_counter()  # Fell behind; don't burst
+            else:
+                self.stop_event.wait(delay)
@@ -0,0 +1,584 @@
+import argparse
+import configparser
+import logging
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+import config_manager
+import log_manager
+import output_sinks
+from audio_utils import LogMelCache
+from dictation_service import MAX_UTTERANCE_SEC, DictationService, count_tokens
+
+logger = logging.getLogger(__name__)
+
+SIM_EPOCH = 1_700_000_000.0  # time() at virtual second 0
+# Threads of DictationService that wait through its clock
+CLOCK_THREADS = ("stt-worker", "final-decode", "decode")
+SPEECH_LEVEL = 3000  # RMS of scripted speech, well above speech_threshold
+SILENCE_LEVEL = 10
+WORD_ID_BASE = 30000  # Word ids are written into two samples of each block
+HARNESS_STEP_SEC = 0.1  # Time the harness advances per check while it waits
+TIMEOUT_SLACK_SEC = 10.0  # How long wait_timeout waits past silence_timeout
+# Config variants the script switches between with reloads
+VARIANTS = {
+    "single-pass": {},
+    "two-pass": {"Whisper.draft_model": "tiny.en"},
+    "typed-partials": {
+        "General.type_partials": "true",
+        "Whisper.draft_model": "tiny.en",
+    },
+    "no-deadline": {"Whisper.decode_deadline_factor": "0"},
+    "no-context": {"Whisper.context_tokens": "0"},
+}
+
+
+class SimClock:
+    """Virtual time for DictationService, advanced by the harness.
+
+    Service threads wait only through get(), wait(), join() and sleep(). The
+    harness moves time forward once every such thread is blocked with
+    nothing to do, so hours of dictation run in seconds, and every run of
+    the same script sees the same timing. When the harness itself waits
+    through the clock (in service.stop()), it moves time forward meanwhile.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)  # Waiting service threads
+        self.settled = threading.Condition(self.lock)  # The harness
+        self.waiting = {}  # Thread ident -> (deadline or None, ready function)
+
+    def time(self):
+        return SIM_EPOCH + self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def get(self, queue_, timeout=None):
+        if not self._block(lambda: not queue_.empty(), timeout):
+            raise queue.Empty
+        return queue_.get_nowait()
+
+    def wait(self, event, timeout=None):
+        return self._block(event.is_set, timeout)
+
+    def join(self, thread, timeout=None):
+        self._block(lambda: not thread.is_alive(), timeout)
+
+    def sleep(self, seconds):
+        self._block(lambda: False, seconds)
+
+    def _block(self, ready, timeout):
+        """Waits until ready() or until timeout virtual seconds have passed."""
+        if threading.current_thread().name not in CLOCK_THREADS:
+            return self._run_until(ready, timeout)
+        ident = threading.get_ident()
+        with self.lock:
+            deadline = None if timeout is None else self.now + timeout
+            try:
+                while not ready():
+                    if deadline is not None and self.now >= deadline:
+                        return False
+                    self.waiting[ident] = (deadline, ready)
+                    self.settled.notify()
+                    self.wakeup.wait()
+                return True
+            finally:
+                self.waiting.pop(ident, None)
+
+    def _run_until(self, ready, timeout):
+        """The harness (e.g. in service.stop()) waits by running time forward."""
+        deadline = None if timeout is None else self.now + timeout
+        while not ready():
+            if deadline is not None and self.now >= deadline:
+                return False
+            step = self.now + HARNESS_STEP_SEC
+            self.advance(step if deadline is None else min(step, deadline))
+        return True
+
+    def _quiet(self):
+        """Whether every clock thread waits with nothing to do (lock held)."""
+        for thread in threading.enumerate():
+            if thread.name not in CLOCK_THREADS:
+                continue
+            entry = self.waiting.get(thread.ident)
+            if entry is None:
+                return False  # Running
+            deadline, ready = entry
+            if ready() or (deadline is not None and deadline <= self.now):
+                return False
+        return True
+
+    def settle(self):
+        """Lets the service threads run until they all wait."""
+        with self.lock:
+            while not self._quiet():
+                self.wakeup.notify_all()
+                self.settled.wait(0.001)  # Threads may also wait on each other
+
+    def advance(self, until):
+        """Runs the service threads up to virtual time `until`."""
+        while True:
+            self.settle()
+            with self.lock:
+                due = [
+                    deadline
+                    for deadline, _ in self.waiting.values()
+                    if deadline is not None and self.now < deadline <= until
+                ]
+                self.now = min(due, default=max(until, self.now))
+                self.wakeup.notify_all()
+            if not due:
+                break
+        self.settle()
+
+
+class SimStream:
+    def __init__(self, callback):
+        self.callback = callback
+        self.active = False
+        self.closed = False
+
+    def start(self):
+        self.active = True
+
+    def stop(self):
+        self.active = False
+
+    def close(self):
+        self.active = False
+        self.closed = True
+
+
+class SimAudioSource:
+    """Microphone stand-in: the harness feeds the streams it opens."""
+
+    def __init__(self):
+        self.stream = None
+
+    def open(self, samplerate, blocksize, device, callback):
+        self.stream = SimStream(callback)
+        return self.stream
+
+    def feed(self, block):
+        """Delivers one block if a stream is recording; returns whether it did."""
+        stream = self.stream
+        if stream is None or not stream.active:
+            return False
+        stream.callback(block[:, None], len(block), None, None)
+        return True
+
+
+class SimFeatureExtractor:
+    """A Whisper feature extractor with silent mel filters.
+
+    SimModel never computes features, but CachingFeatureExtractor reads these
+    attributes and the padding default of __call__.
+    """
+
+    n_fft = 400
+    hop_length = 160
+    sampling_rate = 16000
+    mel_filters = np.zeros((80, n_fft // 2 + 1), dtype=np.float32)
+
+    def __call__(self, waveform, padding=160, chunk_length=None):
+        return LogMelCache(self).features(waveform.astype(np.float32), padding)
+
+
+class SimModel:
+    """WhisperModel stand-in that 'recognizes' the word ids of scripted blocks.
+
+    Decoding costs rtf virtual seconds per second of audio, spent lazily
+    per segment of words_per_segment words, like faster-whisper's windows.
+    The longest prompt it was given is kept in longest_prompt (tokens).
+    """
+
+    def __init__(self, clock, block_size, sample_rate, rtf, words_per_segment=8):
+        self.clock = clock
+        self.block_size = block_size
+        self.sample_rate = sample_rate
+        self.rtf = rtf
+        self.words_per_segment = words_per_segment
+        self.feature_extractor = SimFeatureExtractor()
+        self.longest_prompt = 0
+
+    def transcribe(self, audio, **options):
+        prompt = options.get("initial_prompt") or ""
+        self.longest_prompt = max(self.longest_prompt, count_tokens(self, prompt))
+        words = []
+        for offset in range(0, len(audio) - 1, self.block_size):
+            high, low = np.rint(audio[offset : offset + 2] * 32768).astype(int)
+            if high > 0:
+                words.append((high - 1) * WORD_ID_BASE + low)
+        seconds = len(audio) / self.sample_rate
+        info = SimpleNamespace(language="en", language_probability=1.0)
+        return self._segments(words, seconds), info
+
+    def _segments(self, words, seconds):
+        size = self.words_per_segment
+        count = max((len(words) + size - 1) // size, 1)
+        for start in range(0, max(len(words), 1), size):
+            self.clock.sleep(self.rtf * seconds / count)
+            part = words[start : start + size]
+            if part:
+                text = " " + " ".join(f"w{word}" for word in part) + "."
+                yield SimpleNamespace(text=text, avg_logprob=-0.2)
+
+
+class RecordingSink(output_sinks.OutputSink):
+    """Records the events the keyboard gets, with their virtual time."""
+
+    kinds = output_sinks.CallbackSink.kinds
+
+    def __init__(self, clock):
+        super().__init__("simulation", 1, "drop")
+        self.clock = clock
+        self.session = 0  # Utterance ids restart with every session
+        self.events = []  # (time, session, kind, utterance id, text)
+
+    def submit(self, kind, utterance_id, text):
+        if kind not in self.kinds:
+            return
+        self.events.append(
+            (self.clock.perf_counter(), self.session, kind, utterance_id, text)
+        )
+
+
+def make_script(hours, seed=0, silence_timeout=2.0):
+    """Scripted dictation: sessions of speech and pauses, with config reloads.
+
+    Events: ("idle", s), ("toggle",), ("speak", s), ("pause", s),
+    ("wait_timeout",) (stay silent until the silence timeout stops
+    dictation) and ("reload", variant name).
+    """
+    rng = random.Random(seed)
+    longest_pause = min(1.5, 0.8 * silence_timeout) if silence_timeout > 0 else 1.5
+    variants = list(VARIANTS)
+    script = []
+    total = sessions = 0
+    while total < hours * 3600:
+        if sessions % 3 == 0:
+            script.append(("reload", variants[sessions // 3 % len(variants)]))
+        idle = rng.uniform(5, 120)
+        script += [("idle", idle), ("toggle",)]
+        total += idle
+        for _ in range(rng.randint(1, 12)):
+            speech = rng.uniform(0.5, 15.0)
+            pause = rng.uniform(0.3, longest_pause)
+            script += [("speak", speech), ("pause", pause)]
+            total += speech + pause
+        if silence_timeout > 0 and rng.random() < 0.3:
+            script.append(("wait_timeout",))
+            total += silence_timeout
+        else:
+            script.append(("toggle",))
+        sessions += 1
+    return script
+
+
+def simulation_config(variant):
+    config = configparser.ConfigParser()
+    config.read_dict(config_manager.DEFAULT_CONFIG)
+    config.set("General", "text_inserter", "ydotool")  # Never run: no keyboard
+    config.set("Output", "keyboard", "false")  # Recorded by RecordingSink
+    config.set("Advanced", "save_history", "false")
+    config.set("Advanced", "offline", "false")
+    config.set("Advanced", "model_idle_timeout", "0")
+    for name, value in VARIANTS[variant].items():
+        section, key = name.split(".")
+        config.set(section, key, value)
+    return config
+
+
+class Simulation:
+    """Runs a script against a DictationService with fake clock, audio and model."""
+
+    def __init__(self, rtf=0.1, draft_rtf=0.03, seed=0):
+        self.rtf = rtf
+        self.draft_rtf = draft_rtf
+        self.rng = np.random.default_rng(seed)
+        self.clock = SimClock()
+        self.source = SimAudioSource()
+        self.variant = "single-pass"
+        self.service = DictationService(
+            simulation_config(self.variant),
+            clock=self.clock,
+            audio_source=self.source,
+            model_factory=self._model,
+        )
+        self.sink = RecordingSink(self.clock)
+        self.next_word = 1
+        self.spoken = []  # (word id, time its block was delivered, variant)
+        self.sessions = []  # Per session: variant, peak buffer, model busy time
+        self.dictated_seconds = 0.0
+        self.timeouts = []  # Seconds from the last speech to the timeout stop
+        self.errors = []
+        self.models = []
+
+    def _model(self, model, **kwargs):
+        service = self.service
+        draft = service.draft_model_size and service.draft_model_size in str(model)
+        rtf = self.draft_rtf if draft else self.rtf
+        model = SimModel(self.clock, service.block_size, service.sample_rate, rtf)
+        self.models.append(model)
+        return model
+
+    def _block(self, word):
+        service = self.service
+        level = SPEECH_LEVEL if word else SILENCE_LEVEL
+        block = self.rng.normal(0, level, service.block_size).astype(np.int16)
+        if word:
+            block[0], block[1] = divmod(word, WORD_ID_BASE)
+            block[0] += 1
+        else:
+            block[:2] = 0
+        return block
+
+    def _feed(self, seconds, speech):
+        """Feeds blocks for `seconds`; returns False once dictation stopped."""
+        service = self.service
+        block_sec = service.block_size / service.sample_rate
+        for _ in range(max(round(seconds / block_sec), 1)):
+            self.clock.advance(self.clock.now + block_sec)
+            if not service.is_dictating:
+                break
+            word = self.next_word if speech else 0
+            if self.source.feed(self._block(word)):
+                self.dictated_seconds += block_sec
+                if word:
+                    self.spoken.append((word, self.clock.now, self.variant))
+                    self.next_word += 1
+        return service.is_dictating
+
+    def _finish_session(self):
+        """Runs until the STT worker has processed the session's audio."""
+        service = self.service
+        while service.stt_thread and service.stt_thread.is_alive():
+            self.clock.advance(self.clock.now + 0.5)
+        with service.stats_lock:
+            busy = sum(
+                total
+                for kind, (count, total) in service.decode_stats.items()
+                if kind in ("detect", "cached", "draft", "final")
+            )
+        self.sessions.append(
+            {
+                "variant": self.variant,
+                "peak_buffer_sec": service.capture_stats["peak_buffered"]
+                / 2
+                / service.sample_rate,
+                "model_busy_sec": busy,
+                "late": sum(service.decode_timeouts.values()),
+            }
+        )
+
+    def _drain_status(self):
+        while True:
+            try:
+                status, message = self.service.status_queue.get_nowait()
+            except queue.Empty:
+                return
+            if status == "error":
+                self.errors.append(f"{self.clock.now:.1f}s: {message}")
+
+    def run(self, script):
+        service = self.service
+        service.start()
+        service.sinks.append(self.sink)
+        wall_start = time.perf_counter()
+        try:
+            for event in script:
+                kind = event[0]
+                if kind == "reload":
+                    self.variant = event[1]
+                    service.reload_config(simulation_config(self.variant))
+                elif kind == "idle":
+                    self.clock.advance(self.clock.now + event[1])
+                elif kind == "toggle":
+                    was_dictating = service.is_dictating
+                    self.sink.session += not was_dictating
+                    service.toggle_dictation()
+                    self.clock.settle()
+                    if was_dictating:
+                        self._finish_session()
+                elif service.is_dictating and kind in ("speak", "pause"):
+                    if not self._feed(event[1], kind == "speak"):
+                        self._finish_session()  # Stopped by the silence timeout
+                elif service.is_dictating and kind == "wait_timeout":
+                    # Text arriving restarts the silence timer, so allow for it
+                    limit = service.silence_timeout + TIMEOUT_SLACK_SEC
+                    if self._feed(limit, False):
+                        self.errors.append(f"{self.clock.now:.1f}s: no timeout stop")
+                        service.toggle_dictation()
+                    elif self.spoken:
+                        self.timeouts.append(self.clock.now - self.spoken[-1][1])
+                    self._finish_session()
+                self._drain_status()
+        finally:
+            service.stop()
+        return self.report(time.perf_counter() - wall_start)
+
+    def report(self, wall_seconds):
+        """Latency, memory and throughput figures of the run."""
+        spoken = {word: (at, variant) for word, at, variant in self.spoken}
+        output = []
+        # Outputs of one utterance (streamed segments) are measured together
+        utterances = []  # [utterance id, time of its last output, last word]
+        for at, session, kind, utterance_id, text in self.sink.events:
+            words = [int(word) for word in re.findall(r"w(\d+)", text)]
+            if kind == "partial" or not words:
+                continue
+            output += words
+            key = (session, utterance_id)
+            if utterance_id is None or not utterances or utterances[-1][0] != key:
+                utterances.append([key, at, words[-1]])
+            else:
+                utterances[-1][1:] = [at, words[-1]]
+        latencies = {}  # Variant -> seconds from an utterance's last word to its text
+        for _, at, word in utterances:
+            if word in spoken:
+                spoken_at, variant = spoken[word]
+                latencies.setdefault(variant, []).append(at - spoken_at)
+        busy = sum(session["model_busy_sec"] for session in self.sessions)
+        return {
+            "simulated_hours": self.clock.now / 3600,
+            "wall_seconds": wall_seconds,
+            "sessions": len(self.sessions),
+            "words_spoken": len(self.spoken),
+            "words_output": len(output),
+            "words_missing": len(set(spoken) - set(output)),
+            "in_order": output == [word for word, _, _ in self.spoken],
+            "latency": {
+                variant: {
+                    "p50": float(np.percentile(values, 50)),
+                    "p95": float(np.percentile(values, 95)),
+                    "max": max(values),
+                }
+                for variant, values in sorted(latencies.items())
+            },
+            "peak_buffer_sec": max(
+                (session["peak_buffer_sec"] for session in self.sessions), default=0
+            ),
+            "model_utilization": busy / max(self.dictated_seconds, 1e-9),
+            "late_decodes": sum(s["late"] for s in self.sessions),
+            "longest_prompt": max(
+                (model.longest_prompt for model in self.models), default=0
+            ),
+            "timeout_stops": self.timeouts,
+            "errors": self.errors,
+        }
+
+
+def check(report, max_latency, silence_timeout, block_sec, max_prompt):
+    """Returns the invariants the report violates."""
+    failures = list(report["errors"])
+    if report["words_missing"] or not report["in_order"]:
+        failures.append(
+            f"{report['words_missing']} words lost, or output out of order "
+            f"({report['words_output']} output, {report['words_spoken']} spoken)"
+        )
+    for variant, latency in report["latency"].items():
+        if latency["max"] > max_latency:
+            failures.append(
+                f"{variant}: output latency {latency['max']:.2f}s > {max_latency}s"
+            )
+    buffer_limit = MAX_UTTERANCE_SEC + 2 * block_sec
+    if report["peak_buffer_sec"] > buffer_limit:
+        failures.append(
+            f"peak audio buffer {report['peak_buffer_sec']:.1f}s > {buffer_limit}s"
+        )
+    if report["longest_prompt"] > max_prompt:
+        failures.append(
+            f"prompt of {report['longest_prompt']} tokens > {max_prompt} tokens"
+        )
+    if report["model_utilization"] >= 1.0:
+        failures.append(
+            f"model busy {report['model_utilization']:.0%} of the time, "
+            "decoding falls behind"
+        )
+    # The timer restarts when text arrives, at most max_latency after speech
+    timeout_limit = silence_timeout + max_latency + block_sec
+    for stopped_after in report["timeout_stops"]:
+        if not silence_timeout < stopped_after <= timeout_limit:
+            failures.append(
+                f"silence timeout stopped dictation {stopped_after:.2f}s after "
+                f"speech (silence_timeout {silence_timeout}s)"
+            )
+    return failures
+
+
+def print_report(report):
+    print(
+        f"Simulated {report['simulated_hours']:.1f} h ({report['sessions']} sessions)"
+        f" in {report['wall_seconds']:.1f} s"
+    )
+    print(
+        f"Words: {report['words_spoken']} spoken, {report['words_output']} output, "
+        f"{report['words_missing']} missing"
+    )
+    for variant, latency in report["latency"].items():
+        print(
+            f"  {variant:<15} utterance end to text: p50 {latency['p50']:.2f}s, "
+            f"p95 {latency['p95']:.2f}s, max {latency['max']:.2f}s"
+        )
+    print(
+        f"Peak audio buffer {report['peak_buffer_sec']:.1f}s, model busy "
+        f"{report['model_utilization']:.0%} of dictation time, "
+        f"{report['late_decodes']} decodes past the deadline, "
+        f"{len(report['timeout_stops'])} silence timeout stops, "
+        f"longest prompt {report['longest_prompt']} tokens"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run scripted dictation against the service in virtual time."
+    )
+    parser.add_argument("--hours", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--rtf", type=float, default=0.1, help="Real-time factor of the main model"
+    )
+    parser.add_argument(
+        "--draft-rtf",
+        type=float,
+        default=0.03,
+        help="Real-time factor of the draft model",
+    )
+    parser.add_argument(
+        "--max-latency",
+        type=float,
+        default=5.0,
+        help="Limit on seconds from the end of an utterance to its text",
+    )
+    args = parser.parse_args()
+    log_manager.setup_logging("WARNING")
+
+    config = simulation_config("single-pass")
+    silence_timeout = config.getfloat("General", "silence_timeout")
+    block_sec = config.getint("Advanced", "block_size") / config.getint(
+        "Advanced", "sample_rate"
+    )
+    script = make_script(args.hours, args.seed, silence_timeout)
+    report = Simulation(args.rtf, args.draft_rtf, args.seed).run(script)
+    print_report(report)
+    max_prompt = config.getint("Whisper", "context_tokens")
+    failures = check(report, args.max_latency, silence_timeout, block_sec, max_prompt)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK: all invariants hold")
+
+
+if __name__ == "__main__":
+    main()
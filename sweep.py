@@ -0,0 +1,473 @@
+import argparse
+import functools
+import itertools
+import json
+import multiprocessing
+import re
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import config_manager
+import model_store
+from audio_utils import AudioBuffer, read_wav
+
+RESULTS_FILENAME = "sweep_results.json"
+REFERENCE_CLIP_SEC = 10.0
+BOUNDARY_WORDS = 2  # Errors this close to where two chunks meet are boundary errors
+# Formant frequencies (Hz) of a few vowels, for the synthetic reference clip
+VOWEL_FORMANTS = (
+    (730, 1090, 2440),
+    (270, 2290, 3010),
+    (300, 870, 2240),
+    (530, 1840, 2480),
+    (570, 840, 2410),
+)
+
+
+def load_corpus(corpus_dir):
+    """Returns (wav path, reference text) for every WAV with a matching .txt file."""
+    corpus = []
+    for wav_path in sorted(Path(corpus_dir).glob("*.wav")):
+        txt_path = wav_path.with_suffix(".txt")
+        if txt_path.exists():
+            corpus.append((str(wav_path), txt_path.read_text().strip()))
+        else:
+            print(f"Skipping {wav_path.name}: no {txt_path.name}")
+    return corpus
+
+
+def _words(text):
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+
+def word_errors(reference, hypothesis):
+    """Returns (edit distance in words, reference word count)."""
+    ref, hyp = _words(reference), _words(hypothesis)
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hyp, 1):
+            current.append(
+                min(
+                    previous[j] + 1,  # Deletion
+                    current[j - 1] + 1,  # Insertion
+                    previous[j - 1] + (ref_word != hyp_word),  # Substitution
+                )
+            )
+        previous = current
+    return previous[-1], len(ref)
+
+
+def boundary_errors(reference, chunk_texts):
+    """Returns (word errors next to a chunk join, number of joins).
+
+    Counts the words lost, repeated or changed where the text of one chunk
+    meets the next, e.g. a restarted sentence or a word decoded twice.
+    """
+    ref, hyp, joins = _words(reference), [], set()
+    for text in chunk_texts:
+        if hyp:
+            joins.add(len(hyp))  # Index of the first word after the join
+        hyp += _words(text)
+    cost = [list(range(len(hyp) + 1))]
+    for i, ref_word in enumerate(ref, 1):
+        row = [i]
+        for j, hyp_word in enumerate(hyp, 1):
+            row.append(
+                min(
+                    cost[i - 1][j] + 1,
+                    row[j - 1] + 1,
+                    cost[i - 1][j - 1] + (ref_word != hyp_word),
+                )
+            )
+        cost.append(row)
+    # Walk back through the table to find where in hyp each edit is
+    edits = []
+    i, j = len(ref), len(hyp)
+    while i or j:
+        if i and j and cost[i][j] == cost[i - 1][j - 1] + (ref[i - 1] != hyp[j - 1]):
+            if ref[i - 1] != hyp[j - 1]:
+                edits.append(j - 1)  # Substitution
+            i, j = i - 1, j - 1
+        elif j and cost[i][j] == cost[i][j - 1] + 1:
+            edits.append(j - 1)  # Insertion
+            j -= 1
+        else:
+            edits.append(j)  # Deletion, before hyp[j]
+            i -= 1
+    near = sum(
+        any(join - BOUNDARY_WORDS <= edit < join + BOUNDARY_WORDS for join in joins)
+        for edit in edits
+    )
+    return near, len(joins)
+
+
+def _chunks(audio, block_size, chunk_sec, sample_rate):
+    """Splits audio the way _stt_worker buffers it (whole file if chunk_sec=0)."""
+    if chunk_sec <= 0:
+        buffer = AudioBuffer()
+        buffer.append(audio)
+        yield buffer
+        return
+    buffer = AudioBuffer()
+    for offset in range(0, len(audio), block_size):
+        buffer.append(audio[offset : offset + block_size])
+        if len(buffer) / sample_rate > chunk_sec:
+            yield buffer
+            buffer = AudioBuffer()
+    if len(buffer) > sample_rate * 0.2:  # Same minimum as on stop
+        yield buffer
+
+
+def reference_clip(sample_rate, seconds=REFERENCE_CLIP_SEC):
+    """A fixed, speech-like float32 clip for timing models without a corpus.
+
+    Voiced syllables (harmonics of a gliding pitch shaped by vowel formants,
+    each starting with a short noise burst) grouped into words and phrases.
+    It exercises the encoder exactly like speech; how much the decoder
+    outputs for it differs between models, so compare the words decoded too.
+    """
+    rng = np.random.default_rng(0)
+    clip = np.zeros(int(seconds * sample_rate), dtype=np.float32)
+    position = int(0.3 * sample_rate)
+    while True:
+        for _ in range(rng.integers(1, 4)):  # Syllables per word
+            length = int(rng.uniform(0.12, 0.25) * sample_rate)
+            if position + length > len(clip):
+                return clip
+            t = np.arange(length) / sample_rate
+            pitch = rng.uniform(100, 160) * (1 + 0.1 * t / t[-1])
+            phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+            formants = VOWEL_FORMANTS[rng.integers(len(VOWEL_FORMANTS))]
+            syllable = np.zeros(length)
+            for harmonic in range(1, int(4000 / pitch.max())):
+                frequency = harmonic * pitch.mean()
+                gain = sum(np.exp(-(((frequency - f) / 120) ** 2)) for f in formants)
+                syllable += (gain + 0.02) / harmonic * np.sin(harmonic * phase)
+            syllable *= np.hanning(length)
+            burst = int(0.02 * sample_rate)
+            syllable[:burst] += 0.3 * rng.standard_normal(burst) * np.hanning(burst)
+            clip[position : position + length] = 0.3 * syllable / np.abs(syllable).max()
+            position += length
+        position += int(rng.choice([0.08, 0.08, 0.15, 0.5]) * sample_rate)
+
+
+def benchmark_model(config, model_size, compute_type, beam_size):
+    """Times loading a model and decoding the reference clip on this machine.
+
+    Returns load_seconds, decode_seconds, rtf (decode time / clip length)
+    and the number of words decoded.
+    """
+    from dictation_service import token_budget, transcribe_options
+
+    device = config.get("General", "device")
+    if compute_type == "auto":
+        compute_type = model_store.recommended_compute_type(device)
+    start_time = time.perf_counter()
+    model = model_store.load_model(
+        model_store.get_model_dir(config), model_size, compute_type, device=device
+    )
+    load_seconds = time.perf_counter() - start_time
+
+    clip = reference_clip(model.feature_extractor.sampling_rate)
+    language = config.get("General", "language")
+    options = transcribe_options(
+        None if language == "auto" else language,
+        beam_size,
+        False,  # The VAD would time silero, not the model
+        None,
+        max_new_tokens=token_budget(
+            REFERENCE_CLIP_SEC, config.getfloat("Whisper", "max_tokens_per_second")
+        ),
+    )
+    # The first decode also sets up the model; time the second one
+    for _ in model.transcribe(clip[: len(clip) // 10], **options)[0]:
+        pass
+    start_time = time.perf_counter()
+    segments, _ = model.transcribe(clip, **options)
+    text = "".join(segment.text for segment in segments)
+    decode_seconds = time.perf_counter() - start_time
+    return {
+        "load_seconds": load_seconds,
+        "decode_seconds": decode_seconds,
+        "rtf": decode_seconds / REFERENCE_CLIP_SEC,
+        "words": len(_words(text)),
+    }
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run_config(job):
+    """Runs the corpus with one configuration (in a fresh process)."""
+    from dictation_service import (
+        DECODE_CHUNK_SEC,
+        PromptContext,
+        count_tokens,
+        decode_deadline,
+        decode_prompt,
+        decode_windows,
+        token_budget,
+        transcribe_options,
+        update_decode_cost,
+    )
+
+    settings, corpus, options = job
+    chunk_sec = DECODE_CHUNK_SEC if options["chunked"] else 0
+    start_time = time.perf_counter()
+    model = model_store.load_model(
+        options["model_dir"],
+        settings["model_size"],
+        settings["compute_type"],
+        device=options["device"],
+    )
+    load_seconds = time.perf_counter() - start_time
+
+    errors = reference_words = timeouts = noise_words = 0
+    near_joins = joins = 0
+    audio_seconds = decode_seconds = 0.0
+    latencies = []
+    cost = None  # Measured seconds per 30 s window, as in the service
+    for wav_path, reference in corpus:
+        audio = read_wav(wav_path, options["sample_rate"])
+        audio_seconds += len(audio) / options["sample_rate"]
+        # Like the service, prompt each chunk with the text before it; the
+        # position in the file stands in for the time of day
+        context = PromptContext(
+            settings["context_tokens"],
+            options["context_reset_sec"],
+            functools.partial(count_tokens, model),
+        )
+        position = 0.0
+        chunk_texts = []
+        for chunk in _chunks(
+            audio, options["block_size"], chunk_sec, options["sample_rate"]
+        ):
+            chunk_start = time.perf_counter()
+            chunk_seconds = len(chunk) / options["sample_rate"]
+            position += chunk_seconds
+            prompt = decode_prompt(
+                options["initial_prompt"],
+                context.prompt(options["language"], position),
+            )
+            segments, _ = model.transcribe(
+                chunk.to_float32(),
+                **transcribe_options(
+                    options["language"],
+                    settings["beam_size"],
+                    options["use_vad"],
+                    prompt,
+                    max_new_tokens=token_budget(
+                        chunk_seconds, options["max_tokens_per_second"]
+                    ),
+                    compression_ratio_threshold=options["compression_ratio_threshold"],
+                    no_speech_threshold=options["no_speech_threshold"],
+                ),
+            )
+            # Like the service, count decodes past the deadline but keep their text
+            deadline = decode_deadline(
+                None if cost is None else cost * decode_windows(chunk_seconds),
+                options["deadline_factor"],
+            )
+            text = "".join(segment.text for segment in segments)
+            latency = time.perf_counter() - chunk_start
+            if deadline and latency > deadline:
+                timeouts += 1
+            cost = update_decode_cost(cost, latency, chunk_seconds)
+            latencies.append(latency)
+            decode_seconds += latency
+            chunk_texts.append(text)
+            context.commit(text, options["language"], position)
+        file_errors, file_words = word_errors(reference, "".join(chunk_texts))
+        errors += file_errors
+        reference_words += file_words
+        if not file_words:  # Noise or silence clip: every word is hallucinated
+            noise_words += file_errors
+        else:
+            file_near, file_joins = boundary_errors(reference, chunk_texts)
+            near_joins += file_near
+            joins += file_joins
+
+    return dict(
+        settings,
+        wer=errors / max(reference_words, 1),
+        rtf=decode_seconds / max(audio_seconds, 1e-9),
+        peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        load_seconds=load_seconds,
+        p50_ms=_percentile(latencies, 0.5) * 1000 if latencies else 0.0,
+        p95_ms=_percentile(latencies, 0.95) * 1000 if latencies else 0.0,
+        max_ms=max(latencies) * 1000 if latencies else 0.0,
+        timeouts=timeouts,
+        noise_words=noise_words,
+        boundary_errors=near_joins / max(joins, 1),
+    )
+
+
+def mark_pareto(results):
+    """Flags results not beaten on WER, real-time factor and peak RSS at once."""
+    keys = ("wer", "rtf", "peak_rss_mb")
+    for result in results:
+        result["pareto"] = not any(
+            all(other[key] <= result[key] for key in keys)
+            and any(other[key] < result[key] for key in keys)
+            for other in results
+        )
+
+
+def print_results(results):
+    print(
+        f"{'#':>3} {'model':16} {'compute':12} {'beam':>4} {'ctx':>4} {'WER':>7} "
+        f"{'RTF':>6} {'RSS MB':>7} {'load s':>6} {'p50 ms':>7} {'p95 ms':>7} "
+        f"{'max ms':>7} {'t/o':>4} {'noise w':>7} {'bnd':>5}"
+    )
+    for index, result in enumerate(results):
+        print(
+            f"{index:>3} {result['model_size']:16} {result['compute_type']:12} "
+            f"{result['beam_size']:>4} {result['context_tokens']:>4} "
+            f"{result['wer']:>7.1%} {result['rtf']:>6.3f} "
+            f"{result['peak_rss_mb']:>7.0f} {result['load_seconds']:>6.1f} "
+            f"{result['p50_ms']:>7.0f} {result['p95_ms']:>7.0f} "
+            f"{result['max_ms']:>7.0f} {result['timeouts']:>4} "
+            f"{result['noise_words']:>7} {result['boundary_errors']:>5.2f}"
+            + ("  *" if result["pareto"] else "")
+        )
+    print("* = Pareto-optimal (no other config is better on WER, RTF and RSS)")
+    print("ctx = context_tokens (0 = every chunk decoded without the text before it)")
+    print("t/o = decodes that ran past their deadline")
+    print("noise w = words output for clips with an empty transcript")
+    print("bnd = word errors within two words of a chunk join, per join")
+
+
+def apply_result(result, config):
+    """Writes the settings of one sweep result to config.ini."""
+    config.set("General", "model_size", result["model_size"])
+    config.set("General", "compute_type", result["compute_type"])
+    config.set("Whisper", "beam_size", str(result["beam_size"]))
+    config.set("Whisper", "context_tokens", str(result["context_tokens"]))
+    config_manager.save_config(config)
+    print(
+        f"Saved model_size={result['model_size']} "
+        f"compute_type={result['compute_type']} beam_size={result['beam_size']} "
+        f"context_tokens={result['context_tokens']} "
+        f"to {config_manager.get_config_path()}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure speed/accuracy of model settings on a WAV corpus."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="Sweep the settings grid")
+    run.add_argument("corpus", help="Directory of .wav files with .txt transcripts")
+    run.add_argument("--models", nargs="+", help="Model sizes (default: config)")
+    run.add_argument("--compute-types", nargs="+", help="Compute types")
+    run.add_argument("--beam-sizes", nargs="+", type=int, help="Beam sizes")
+    run.add_argument(
+        "--context-tokens",
+        nargs="+",
+        type=int,
+        help="Prompt context sizes (0 = decode each chunk without context)",
+    )
+    run.add_argument(
+        "--whole-files",
+        action="store_true",
+        help="Decode each file at once instead of in dictation-sized chunks",
+    )
+    run.add_argument(
+        "--no-limits",
+        action="store_true",
+        help="Decode without token budgets and deadlines, to compare",
+    )
+    run.add_argument("--out", default=RESULTS_FILENAME, help="Results file")
+    apply = commands.add_parser("apply", help="Write a swept config to config.ini")
+    apply.add_argument("row", type=int, help="Row number from the results table")
+    apply.add_argument("--results", default=RESULTS_FILENAME)
+    args = parser.parse_args()
+
+    config = config_manager.load_config()
+    if args.command == "apply":
+        with open(args.results) as f:
+            results = json.load(f)
+        apply_result(results[args.row], config)
+        return
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        parser.error(f"No labelled WAV files in {args.corpus}")
+    device = config.get("General", "device")
+    compute_types = args.compute_types or [config.get("General", "compute_type")]
+    compute_types = [
+        model_store.recommended_compute_type(device) if ct == "auto" else ct
+        for ct in compute_types
+    ]
+    language = config.get("General", "language")
+    options = {
+        "device": device,
+        "model_dir": str(model_store.get_model_dir(config)),
+        "sample_rate": config.getint("Advanced", "sample_rate"),
+        "block_size": config.getint("Advanced", "block_size"),
+        "language": None if language == "auto" else language,
+        "use_vad": config.getboolean("Whisper", "use_vad_filter"),
+        "initial_prompt": config.get("Whisper", "initial_prompt") or None,
+        "context_reset_sec": config.getfloat("Whisper", "context_reset_sec"),
+        "chunked": not args.whole_files,
+        "max_tokens_per_second": (
+            0 if args.no_limits else config.getfloat("Whisper", "max_tokens_per_second")
+        ),
+        "compression_ratio_threshold": config.getfloat(
+            "Whisper", "compression_ratio_threshold"
+        ),
+        "no_speech_threshold": config.getfloat("Whisper", "no_speech_threshold"),
+        "deadline_factor": (
+            0
+            if args.no_limits
+            else config.getfloat("Whisper", "decode_deadline_factor")
+        ),
+    }
+    grid = itertools.product(
+        args.models or [config.get("General", "model_size")],
+        compute_types,
+        args.beam_sizes or [config.getint("Whisper", "beam_size")],
+        args.context_tokens or [config.getint("Whisper", "context_tokens")],
+    )
+
+    results = []
+    spawn = multiprocessing.get_context("spawn")
+    for model_size, compute_type, beam_size, context_tokens in grid:
+        settings = {
+            "model_size": model_size,
+            "compute_type": compute_type,
+            "beam_size": beam_size,
+            "context_tokens": context_tokens,
+        }
+        print(
+            f"Running {model_size} / {compute_type} / beam {beam_size} "
+            f"/ context {context_tokens}..."
+        )
+        # A fresh process per config keeps peak RSS and load time independent
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            try:
+                results.append(
+                    pool.submit(run_config, (settings, corpus, options)).result()
+                )
+            except Exception as e:
+                print(f"  failed: {e}")
+
+    if not results:
+        return
+    mark_pareto(results)
+    print_results(results)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.out}. Apply one with: python sweep.py apply ROW")
+
+
+if __name__ == "__main__":
+    main()